@@ -0,0 +1,125 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from vaccination_data import current_vaccine_data, run_rate_index
+from shared_arrays import column_values
+
+# part of every key: bump when the fields derived from the csvs change, so older entries are never served
+CACHE_VERSION = 2
+DEFAULT_CACHE_DIR = '.vac_cache'
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+
+def file_digest(fname, block_size=1 << 20):
+    """sha256 of a file's contents"""
+    digest = hashlib.sha256()
+    with open(fname, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def cache_key(fd_fname, sd_fname, target_val, orig_target_date, rev_target_date):
+    """key for a prepared current_vaccine_data: the content of both input files plus the target parameters"""
+    key = json.dumps({'version': CACHE_VERSION,
+                      'fd': file_digest(fd_fname),
+                      'sd': file_digest(sd_fname),
+                      'target_val': target_val,
+                      'orig_target_date': orig_target_date,
+                      'rev_target_date': rev_target_date}, sort_keys=True)
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def save_actual_data(actual_data, entry_dir):
+    """write vac_df as one .npy per column plus a json of the run rates, waffle data and targets"""
+    os.makedirs(entry_dir)
+    columns = {}
+    for col in actual_data.vac_df.columns:
+        np.save(os.path.join(entry_dir, f'{len(columns)}.npy'), column_values(actual_data.vac_df[col]))
+        columns[col] = f'{len(columns)}.npy'
+
+    meta = {'columns': columns,
+            'target_val': actual_data.target_val,
+            'orig_target_date': actual_data.orig_target_date.isoformat(),
+            'rev_target_date': actual_data.rev_target_date.isoformat(),
+            'today': actual_data.today.isoformat(),
+            'daily_avg_3month': [float(v) for v in actual_data.daily_avg_3month],
+            'daily_avg_1month': [float(v) for v in actual_data.daily_avg_1month],
+            'daily_avg_week': [float(v) for v in actual_data.daily_avg_week],
+            'unadjusted_first_row': [float(v) for v in actual_data.unadjusted_first_row],
+            'waffle': actual_data.waffle_df.to_dict(orient='list')}
+    with open(os.path.join(entry_dir, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+
+
+def load_cached_actual_data(entry_dir):
+    """rebuild a current_vaccine_data from a cache entry without touching the csvs. columns are read from the memory
+    mapped .npy files into vac_df (pandas copies them into its own blocks)"""
+    with open(os.path.join(entry_dir, 'meta.json')) as f:
+        meta = json.load(f)
+
+    actual_data = current_vaccine_data.__new__(current_vaccine_data)
+    actual_data.vac_df = pd.DataFrame({col: np.load(os.path.join(entry_dir, fname), mmap_mode='r')
+                                       for col, fname in meta['columns'].items()})
+    actual_data.target_val = meta['target_val']
+    actual_data.orig_target_date = pd.Timestamp(meta['orig_target_date']).to_pydatetime()
+    actual_data.rev_target_date = pd.Timestamp(meta['rev_target_date']).to_pydatetime()
+    actual_data.set_today(pd.Timestamp(meta['today']).to_pydatetime())
+    actual_data.daily_avg_3month = tuple(meta['daily_avg_3month'])
+    actual_data.daily_avg_1month = tuple(meta['daily_avg_1month'])
+    actual_data.daily_avg_week = tuple(meta['daily_avg_week'])
+    actual_data.unadjusted_first_row = tuple(meta['unadjusted_first_row'])
+    actual_data.waffle_df = pd.DataFrame(meta['waffle'])
+
+    # the run rate index is over the stats before the one-off prior allocation on the first row
+    stats_df = actual_data.vac_df[['date', 'daily_all_vac', 'daily_first_dose', 'daily_second_dose']].copy()
+    stats_df.loc[0, ['daily_first_dose', 'daily_second_dose']] = actual_data.unadjusted_first_row
+    actual_data.run_rate_index = run_rate_index(stats_df)
+    return actual_data
+
+
+def entry_size(entry_dir):
+    return sum(entry.stat().st_size for entry in os.scandir(entry_dir))
+
+
+def evict(cache_dir, max_bytes):
+    """remove least recently used entries until the cache fits in max_bytes"""
+    entries = [entry for entry in os.scandir(cache_dir) if entry.is_dir() and not entry.name.startswith('.')]
+    entries.sort(key=lambda entry: entry.stat().st_mtime, reverse=True)
+    total = 0
+    for entry in entries:
+        total += entry_size(entry.path)
+        if total > max_bytes:
+            shutil.rmtree(entry.path, ignore_errors=True)
+
+
+def load_actual_data(fd_fname, sd_fname, target_val = 53000000, orig_target_date = '31/07/2021', rev_target_date = '31/08/2021',
+                     cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+    """current_vaccine_data for the given files and targets, from the on-disk cache if the same file contents and
+    targets have been prepared before (by any process), otherwise built and added to the cache"""
+    key = cache_key(fd_fname, sd_fname, target_val, orig_target_date, rev_target_date)
+    entry_dir = os.path.join(cache_dir, key)
+    if os.path.isdir(entry_dir):
+        os.utime(entry_dir)
+        return load_cached_actual_data(entry_dir)
+
+    actual_data = current_vaccine_data(fd_fname, sd_fname, target_val, orig_target_date, rev_target_date)
+
+    # write to a temp dir and rename into place so concurrent workers never see a half written entry
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(prefix='.tmp-', dir=cache_dir)
+    try:
+        save_actual_data(actual_data, os.path.join(tmp_dir, 'entry'))
+        os.replace(os.path.join(tmp_dir, 'entry'), entry_dir)
+    except OSError:
+        pass
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    evict(cache_dir, max_bytes)
+    return actual_data
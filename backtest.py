@@ -0,0 +1,192 @@
+"""Backtest the projection against what actually happened.
+
+Re-runs the projection as of every historical publish date in a long format feed (csv, or the first page of a
+paginated json source), each time from only the rows published before that date, and scores the projected
+cumu_first_dose / cumu_second_dose h days later against the later actuals. Run on its own, e.g.
+
+    python backtest.py long_feed.csv backtest.parquet --area-types region --horizons 7 14 28 --workers 4
+
+The scores go to one columnar table (parquet or feather with pyarrow installed, otherwise .npz) with a row per area, as of date, run rate window and
+horizon, and a summary of mean absolute percentage error per run rate window and horizon is printed.
+"""
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+
+from vaccination_data import current_vaccine_data
+from projection_data import projected_data
+from feed_stream import stream_area_feeds
+from scenario_sweep import project_realisations
+from shared_arrays import shared_arrays, attach_frame
+from batch_projection import batch_output_fname, write_batch_output
+import projection_engine
+
+RUN_RATE_WINDOWS = ('weekly_avg', 'monthly_avg', '3_month_avg')
+HORIZONS = (7, 14, 28, 56)
+SCORE_COLUMNS = ['as_of', 'run_rate_window', 'horizon_days', 'date', 'capacity', 'projected_cumu_first_dose',
+                 'actual_cumu_first_dose', 'projected_cumu_second_dose', 'actual_cumu_second_dose', 'error_first_dose',
+                 'abs_pct_error_first_dose', 'error_second_dose', 'abs_pct_error_second_dose']
+
+
+def as_of_dates(dates, horizons=HORIZONS, min_history=28, step=1):
+    """publish dates to backtest from: every step days once there are min_history days of actuals before it, up to
+    the last date with at least the shortest horizon of later actuals to score against"""
+    dates = pd.DatetimeIndex(dates).sort_values()
+    first = dates[0] + timedelta(days=min_history)
+    last = dates[-1] - timedelta(days=int(min(horizons)) - 1)
+    return pd.date_range(first, last, freq=f'{step}D')
+
+
+def project_as_of(area_df, as_of, windows=RUN_RATE_WINDOWS, horizons=HORIZONS, target_val=53000000):
+    """project from the rows of area_df published before as_of, at each window's run rate. returns the projection
+    dates and projected cumulative first and second doses, (windows, days), NaN where the projection failed"""
+    end_date = (as_of + timedelta(days=int(max(horizons)))).strftime('%d/%m/%Y')
+    available = area_df[area_df['date'] < as_of].reset_index(drop=True)
+    actual_data = current_vaccine_data.from_frames(available, available, target_val=target_val,
+                                                   orig_target_date=end_date, rev_target_date=end_date)
+
+    capacities = []
+    for window in windows:
+        projection = projected_data(actual_data, run_rate_window=window, randomise_daily_capacity="False", cache=None)
+        projection.get_capacity()
+        capacities.append(projection.capacity)
+    projection.create_empty_projected_df()
+    inputs = projection.projection_inputs()
+
+    capacities = np.array(capacities, dtype=np.float64)
+    visit_capacities = np.repeat(capacities[:, None], len(inputs['order']), axis=1)
+    day_scale = np.ones((len(windows), len(inputs['dates'])))
+    first, second = project_realisations(inputs, visit_capacities, day_scale, np.ones(len(windows), dtype=bool))
+    return (inputs['dates'], capacities,
+            projection_engine.fill_cumulative(first, inputs['cumu_first_dose']),
+            projection_engine.fill_cumulative(second, inputs['cumu_second_dose']))
+
+
+def backtest_area(area_df, as_of, windows=RUN_RATE_WINDOWS, horizons=HORIZONS, target_val=53000000):
+    """score the projections from each as_of date of one area's feed. area_df is the whole feed for the area (govt
+    columns, one row per date); only rows before each as_of date go into its projection, the rest are the actuals
+    it's scored against. returns a df with a row per as_of date, window and horizon that has an actual to compare"""
+    actuals = area_df.set_index('date')[['cumPeopleVaccinatedFirstDoseByPublishDate',
+                                         'cumPeopleVaccinatedSecondDoseByPublishDate']]
+    horizons = np.asarray(horizons)
+    rows = []
+    for date in as_of:
+        dates, capacities, cumu_first, cumu_second = project_as_of(area_df, date, windows, horizons, target_val)
+        # horizon h is the end of the h-th projected day
+        score_dates = pd.DatetimeIndex(date + pd.to_timedelta(horizons - 1, unit='D'))
+        positions = np.searchsorted(dates, score_dates.values)
+        actual = actuals.reindex(score_dates)
+        for i, window in enumerate(windows):
+            rows.append(pd.DataFrame({'as_of': date,
+                                      'run_rate_window': window,
+                                      'horizon_days': horizons,
+                                      'date': score_dates,
+                                      'capacity': capacities[i],
+                                      'projected_cumu_first_dose': cumu_first[i, positions],
+                                      'actual_cumu_first_dose': actual.iloc[:, 0].values,
+                                      'projected_cumu_second_dose': cumu_second[i, positions],
+                                      'actual_cumu_second_dose': actual.iloc[:, 1].values}))
+    if not rows:
+        return pd.DataFrame(columns=SCORE_COLUMNS)
+    scores = pd.concat(rows, ignore_index=True)
+    scores = scores[scores['actual_cumu_first_dose'].notna()].reset_index(drop=True)
+    for dose in ['first_dose', 'second_dose']:
+        error = scores[f'projected_cumu_{dose}'] - scores[f'actual_cumu_{dose}']
+        scores[f'error_{dose}'] = error
+        scores[f'abs_pct_error_{dose}'] = 100 * error.abs() / scores[f'actual_cumu_{dose}']
+    return scores
+
+
+def backtest_shared_area(path, start, stop, area_code, as_of, **kwargs):
+    """backtest_area on rows start:stop of the feed published to shared_arrays at path"""
+    area_df = attach_frame(path, start, stop)
+    area_df['date'] = pd.to_datetime(area_df['date'])
+    scores = backtest_area(area_df, as_of, **kwargs)
+    scores.insert(0, 'areaCode', area_code)
+    return scores
+
+
+def run_backtest(feed_fname, area_codes=None, area_types=None, windows=RUN_RATE_WINDOWS, horizons=HORIZONS,
+                 min_history=28, step=1, target_vals=None, n_workers=None, dates_per_task=25, chunksize=100000):
+    """backtest every area of a long format feed, filtered to area_types/area_codes as it's streamed in. each area's as
+    of dates are split into tasks of dates_per_task across a process pool of n_workers (None uses the cpu count, 1
+    runs in process), with the feed published once to shared_arrays. target_vals optionally maps areaCode to that
+    area's target, others use the national default.
+
+    Returns one df of scores, see backtest_area, with areaCode first. empty (with the score columns) when no area has
+    an as of date to backtest from"""
+    area_feeds = stream_area_feeds(feed_fname, area_types, area_codes, chunksize)
+    target_vals = target_vals or {}
+
+    tasks = []
+    area_codes = sorted(area_feeds)
+    bounds = np.cumsum([0] + [len(area_feeds[area_code]) for area_code in area_codes]).tolist()
+    for i, area_code in enumerate(area_codes):
+        kwargs = {'windows': windows, 'horizons': horizons}
+        if area_code in target_vals:
+            kwargs['target_val'] = target_vals[area_code]
+        dates = as_of_dates(area_feeds[area_code]['date'], horizons, min_history, step)
+        for j in range(0, len(dates), dates_per_task):
+            tasks.append((bounds[i], bounds[i + 1], area_code, dates[j:j + dates_per_task], kwargs))
+    if not tasks:
+        return pd.DataFrame(columns=['areaCode'] + SCORE_COLUMNS)
+
+    feed_df = pd.concat([area_feeds.pop(area_code) for area_code in area_codes], ignore_index=True)
+    with shared_arrays.from_frame(feed_df) as shared:
+        del feed_df
+        if n_workers == 1:
+            results = [backtest_shared_area(shared.path, start, stop, area_code, as_of, **kwargs)
+                       for start, stop, area_code, as_of, kwargs in tasks]
+        else:
+            with ProcessPoolExecutor(max_workers=n_workers) as executor:
+                futures = [executor.submit(backtest_shared_area, shared.path, start, stop, area_code, as_of, **kwargs)
+                           for start, stop, area_code, as_of, kwargs in tasks]
+                results = [future.result() for future in futures]
+
+    scores = pd.concat(results, ignore_index=True)
+    scores['areaCode'] = scores['areaCode'].astype('category')
+    scores['run_rate_window'] = scores['run_rate_window'].astype('category')
+    return scores
+
+
+def summarise(scores):
+    """mean absolute percentage error of each dose per run rate window and horizon, with the number of projections
+    scored and how many failed (overflow ran out of horizon)"""
+    grouped = scores.groupby(['run_rate_window', 'horizon_days'], observed=True)
+    summary = grouped[['abs_pct_error_first_dose', 'abs_pct_error_second_dose']].mean()
+    summary['projections'] = grouped.size()
+    summary['failed'] = grouped['projected_cumu_first_dose'].apply(lambda values: int(values.isna().sum()))
+    return summary.reset_index()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('feed_fname', help='long format feed, csv or the first page of a json source')
+    parser.add_argument('output', help='scores table to write, .parquet/.feather (needs pyarrow) or .npz')
+    parser.add_argument('--area-types', nargs='+', default=None)
+    parser.add_argument('--area-codes', nargs='+', default=None)
+    parser.add_argument('--windows', nargs='+', choices=RUN_RATE_WINDOWS, default=list(RUN_RATE_WINDOWS))
+    parser.add_argument('--horizons', nargs='+', type=int, default=list(HORIZONS), help='days ahead to score')
+    parser.add_argument('--min-history', type=int, default=28, help='days of actuals needed before an as of date')
+    parser.add_argument('--step', type=int, default=1, help='days between as of dates')
+    parser.add_argument('--workers', type=int, default=None, help='process pool size, 1 to run in process')
+    args = parser.parse_args()
+
+    output = batch_output_fname(args.output)
+    if output != args.output:
+        print(f'pyarrow not installed, scores will be written to {output}')
+    scores = run_backtest(args.feed_fname, args.area_codes, args.area_types, args.windows, args.horizons,
+                          args.min_history, args.step, n_workers=args.workers)
+    if scores.empty:
+        parser.exit(1, 'no as of dates to backtest from: check the area filters, or the feed is shorter than '
+                       '--min-history plus the shortest horizon\n')
+    print(summarise(scores).to_string(index=False))
+    write_batch_output(scores, output)
+    print(f'{len(scores)} scores written to {output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+import importlib.util
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from vaccination_data import current_vaccine_data
+from projection_data import projected_data
+from feed_stream import stream_area_feeds
+from instrumentation import instrumentation, memory_sink, jsonl_sink
+from shared_arrays import shared_arrays, attach_frame, column_values
+
+OUTPUT_COLUMNS = ['date', 'status', 'daily_first_dose', 'daily_second_dose', 'cumu_first_dose', 'cumu_second_dose',
+                  'vac_backlog', 'daily_all_vac']
+
+
+def project_area(area_code, area_df, target_val=53000000, run_rate_window="weekly_avg", randomise_daily_capacity="False",
+                 std_dev=0.1, metrics=False):
+    """run the projection for one area's rows of the feed. returns the projection columns tagged with the area and a
+    dict of stage timings in seconds. with metrics, the timings also carry the projection's instrumentation record
+    under 'metrics'"""
+    instrument = instrumentation(memory_sink()) if metrics else None
+    start = time.perf_counter()
+    actual_data = current_vaccine_data.from_frames(area_df, area_df, target_val=target_val)
+    prepared = time.perf_counter()
+
+    projection = projected_data(actual_data, run_rate_window=run_rate_window,
+                                randomise_daily_capacity=randomise_daily_capacity, std_dev=std_dev, instrument=instrument)
+    projection.collate_and_project_data()
+    projected = time.perf_counter()
+
+    result_df = projection.projected_df[OUTPUT_COLUMNS].copy()
+    result_df.insert(0, 'areaName', area_df['areaName'].iloc[0])
+    result_df.insert(0, 'areaCode', area_code)
+    timing = {'areaCode': area_code,
+              'rows': len(area_df),
+              'prepare_seconds': prepared - start,
+              'project_seconds': projected - prepared,
+              'total_seconds': projected - start}
+    if instrument is not None:
+        instrument.stages['prepare'] = {'seconds': prepared - start, 'calls': 1}
+        timing['metrics'] = projection.flush_metrics(areaCode=area_code, rows=len(area_df))
+    return result_df, timing
+
+
+def project_shared_area(path, start, stop, area_code, **kwargs):
+    """project_area on rows start:stop of the feed published to shared_arrays at path"""
+    return project_area(area_code, attach_frame(path, start, stop), **kwargs)
+
+
+def run_area_batch(feed_fname, area_codes=None, target_vals=None, n_workers=None, area_types=None, chunksize=100000,
+                   metrics_fname=None, **projection_kwargs):
+    """project every area in a long format feed (csv, or the first page of a paginated json source), one area per
+    task across a process pool of n_workers (None uses the cpu count, 1 runs in process). the feed is streamed in
+    chunks and filtered to area_types/area_codes as it is read. for a pool the filtered feed is published once to
+    shared_arrays and each task is just its areas' row range. target_vals optionally maps areaCode to that area's
+    target, other areas use the national default. projection_kwargs are passed to projected_data. metrics_fname
+    appends each area's stage timings and counters to a json lines file.
+
+    Returns (projection_df, timings_df): all areas' projections in one df and per area timings, slowest first. raises
+    ValueError if no area matches the filters"""
+    area_feeds = stream_area_feeds(feed_fname, area_types, area_codes, chunksize)
+    target_vals = target_vals or {}
+
+    tasks = []
+    for area_code in sorted(area_feeds):
+        kwargs = dict(projection_kwargs, metrics=metrics_fname is not None)
+        if area_code in target_vals:
+            kwargs['target_val'] = target_vals[area_code]
+        tasks.append((area_code, area_feeds.pop(area_code), kwargs))
+    if not tasks:
+        raise ValueError(f"no areas in {feed_fname} match area_types={area_types} area_codes={area_codes}")
+
+    if n_workers == 1:
+        results = [project_area(area_code, area_df, **kwargs) for area_code, area_df, kwargs in tasks]
+    else:
+        bounds = np.cumsum([0] + [len(area_df) for _, area_df, _ in tasks]).tolist()
+        feed_df = pd.concat([area_df for _, area_df, _ in tasks], ignore_index=True)
+        with shared_arrays.from_frame(feed_df) as shared, ProcessPoolExecutor(max_workers=n_workers) as executor:
+            futures = [executor.submit(project_shared_area, shared.path, bounds[i], bounds[i + 1], area_code, **kwargs)
+                       for i, (area_code, _, kwargs) in enumerate(tasks)]
+            results = [future.result() for future in futures]
+
+    if metrics_fname is not None:
+        sink = jsonl_sink(metrics_fname)
+        for result in results:
+            sink.write(result[1].pop('metrics'))
+
+    projection_df = pd.concat([result[0] for result in results], ignore_index=True)
+    projection_df['areaCode'] = projection_df['areaCode'].astype('category')
+    projection_df['areaName'] = projection_df['areaName'].astype('category')
+    timings_df = pd.DataFrame([result[1] for result in results]).sort_values('total_seconds', ascending=False)
+    return projection_df, timings_df.reset_index(drop=True)
+
+
+def batch_output_fname(fname):
+    """the file write_batch_output will write for fname. parquet and feather need pyarrow, which isn't a dependency;
+    without it (or for any other extension) the table goes to a .npz of columns instead, like the actuals cache's
+    .npy per column. check this before a long run so the output format is known up front"""
+    if fname.endswith(('.parquet', '.feather')) and importlib.util.find_spec('pyarrow') is not None:
+        return fname
+    return os.path.splitext(fname)[0] + '.npz'
+
+
+def write_batch_output(projection_df, fname):
+    """write a table to a columnar file, see batch_output_fname. returns the file written"""
+    fname = batch_output_fname(fname)
+    if fname.endswith('.feather'):
+        projection_df.to_feather(fname)
+    elif fname.endswith('.parquet'):
+        projection_df.to_parquet(fname, index=False)
+    else:
+        np.savez(fname, **{col: column_values(projection_df[col]) for col in projection_df.columns})
+    return fname
+
+
+def read_batch_output(fname):
+    """read a table written by write_batch_output"""
+    if fname.endswith('.feather'):
+        return pd.read_feather(fname)
+    if fname.endswith('.parquet'):
+        return pd.read_parquet(fname)
+    with np.load(fname) as columns:
+        return pd.DataFrame({col: columns[col] for col in columns.files})
@@ -0,0 +1,162 @@
+"""Benchmark the ingest, projection and plotting stages on synthetic feeds.
+
+Run on its own, e.g.
+
+    python benchmark.py --days 365 --regions 4 --repeats 5 --output bench_results.json
+
+Feeds are generated with the same columns as first_dose_data_220321.csv / second_dose_data_220321.csv, ending the
+day before the projection start date. Results (per stage timings, days projected per second and peak traced memory)
+are written as json so runs can be compared between commits.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from vaccination_data import current_vaccine_data
+from projection_data import projected_data
+import batch_projection
+
+LAST_ACTUAL_DATE = datetime(2021, 3, 20)
+PLOTS = ['daily_doses_projection_plot', 'cumulative_doses_plot', 'second_doses_by_month_perc_plot',
+         'second_dose_backlog_daily_plot', 'second_dose_backlog_cumu_plot']
+
+
+def synthetic_feed(n_days, area_code='K02000001', area_name='United Kingdom', scale=1.0, seed=0):
+    """first and second dose dfs shaped like the govt csvs: n_days of data ending LAST_ACTUAL_DATE, newest first"""
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range(end=LAST_ACTUAL_DATE, periods=n_days, freq='D')
+    ramp = np.linspace(0.2, 1.0, n_days)
+    daily_fd = np.round(scale * 400000 * ramp * rng.uniform(0.7, 1.3, n_days)).astype(np.int64)
+    daily_sd = np.round(scale * 60000 * ramp * rng.uniform(0.5, 1.5, n_days)).astype(np.int64)
+    cumu_fd = np.cumsum(daily_fd) + int(scale * 1000000)
+    cumu_sd = np.cumsum(daily_sd) + int(scale * 100000)
+
+    base = pd.DataFrame({'areaType': 'overview' if area_code.startswith('K') else 'region',
+                         'areaName': area_name,
+                         'areaCode': area_code,
+                         'date': dates.strftime('%Y-%m-%d')})
+    fd_df = base.assign(newPeopleVaccinatedFirstDoseByPublishDate=daily_fd,
+                        cumPeopleVaccinatedFirstDoseByPublishDate=cumu_fd)
+    sd_df = base.assign(newPeopleVaccinatedSecondDoseByPublishDate=daily_sd,
+                        cumPeopleVaccinatedSecondDoseByPublishDate=cumu_sd)
+    return fd_df.iloc[::-1], sd_df.iloc[::-1]
+
+
+def write_feeds(out_dir, n_days, n_regions):
+    """write the national csv pair plus a long format csv covering n_regions areas"""
+    fd_df, sd_df = synthetic_feed(n_days)
+    fd_fname = os.path.join(out_dir, 'first_dose.csv')
+    sd_fname = os.path.join(out_dir, 'second_dose.csv')
+    fd_df.to_csv(fd_fname, index=False)
+    sd_df.to_csv(sd_fname, index=False)
+
+    areas = []
+    for i in range(n_regions):
+        area_fd, area_sd = synthetic_feed(n_days, f'E{i:08d}', f'Region {i}', scale=1 / max(n_regions, 1), seed=i + 1)
+        areas.append(area_fd.merge(area_sd, on=['areaType', 'areaName', 'areaCode', 'date']))
+    long_fname = os.path.join(out_dir, 'long_feed.csv')
+    pd.concat(areas).to_csv(long_fname, index=False)
+    return fd_fname, sd_fname, long_fname
+
+
+def time_stage(func, warmup, repeats):
+    """run func warmup times untimed, then repeats times timed. peak memory is traced on one extra run"""
+    for _ in range(warmup):
+        func()
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {'min_seconds': min(timings),
+            'median_seconds': float(np.median(timings)),
+            'max_seconds': max(timings),
+            'repeats': repeats,
+            'peak_memory_bytes': peak}
+
+
+def run_stage(results, name, func, warmup, repeats):
+    try:
+        results[name] = time_stage(func, warmup, repeats)
+    except Exception as e:
+        results[name] = {'error': f'{type(e).__name__}: {e}'}
+    print(f"{name:40s} {results[name].get('median_seconds', results[name].get('error'))}")
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(n_days=70, n_regions=4, target_date='31/07/2021', warmup=1, repeats=5, randomise="False"):
+    with tempfile.TemporaryDirectory() as out_dir:
+        fd_fname, sd_fname, long_fname = write_feeds(out_dir, n_days, n_regions)
+        actual_data = current_vaccine_data(fd_fname, sd_fname, orig_target_date=target_date)
+
+        def project():
+            projection = projected_data(actual_data, randomise_daily_capacity=randomise, cache=None)
+            projection.collate_and_project_data()
+            return projection
+
+        projection = project()
+        days_projected = int((projection.projected_df['status'] == 'projected').sum())
+
+        stages = {}
+        run_stage(stages, 'ingest', lambda: current_vaccine_data(fd_fname, sd_fname, orig_target_date=target_date),
+                  warmup, repeats)
+        run_stage(stages, 'projection', project, warmup, repeats)
+        for plot in PLOTS:
+            run_stage(stages, f'plot.{plot}', getattr(projection, plot), warmup, repeats)
+        if n_regions:
+            run_stage(stages, 'batch_regions', lambda: batch_projection.run_area_batch(
+                long_fname, n_workers=1, randomise_daily_capacity=randomise), warmup, repeats)
+
+    if 'median_seconds' in stages['projection']:
+        stages['projection']['days_projected_per_second'] = days_projected / stages['projection']['median_seconds']
+    if 'median_seconds' in stages.get('batch_regions', {}):
+        stages['batch_regions']['days_projected_per_second'] = n_regions * days_projected / stages['batch_regions']['median_seconds']
+
+    return {'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'numpy': np.__version__,
+            'params': {'days': n_days, 'regions': n_regions, 'target_date': target_date, 'warmup': warmup,
+                       'repeats': repeats, 'randomise': randomise, 'days_projected': days_projected},
+            'stages': stages}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--days', type=int, default=70, help='days of actuals in the synthetic feed')
+    parser.add_argument('--regions', type=int, default=4, help='areas in the synthetic long format feed (0 to skip)')
+    parser.add_argument('--target-date', default='31/07/2021', help='projection horizon end, dd/mm/yyyy')
+    parser.add_argument('--warmup', type=int, default=1)
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--randomise', choices=['True', 'False'], default='False')
+    parser.add_argument('--output', default='bench_results.json', help='json file to write results to')
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.days, args.regions, args.target_date, args.warmup, args.repeats, args.randomise)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f'results written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
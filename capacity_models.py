@@ -0,0 +1,78 @@
+import numpy as np
+import pandas as pd
+
+
+class linear_growth():
+    """capacity rises by weekly_increase (a fraction of the run rate) every week from the first projected day"""
+
+    def __init__(self, weekly_increase):
+        self.weekly_increase = weekly_increase
+
+    def apply(self, capacity, base, dates, start_pos):
+        weeks = np.maximum(np.arange(len(dates)) - start_pos, 0) / 7
+        return capacity + base * self.weekly_increase * weeks
+
+
+class exponential_growth():
+    """capacity compounds by weekly_rate every week from the first projected day"""
+
+    def __init__(self, weekly_rate):
+        self.weekly_rate = weekly_rate
+
+    def apply(self, capacity, base, dates, start_pos):
+        weeks = np.maximum(np.arange(len(dates)) - start_pos, 0) / 7
+        return capacity * (1 + self.weekly_rate) ** weeks
+
+
+class weekday_profile():
+    """weekday seasonality taken from the historical daily_all_vac: each weekday's average over the last n_weeks of
+    actuals relative to the overall average, so the profile averages out to 1 across a week"""
+
+    def __init__(self, vac_df, n_weeks=4):
+        recent = vac_df[vac_df['date'] > vac_df['date'].max() - pd.Timedelta(weeks=n_weeks)]
+        by_weekday = recent.groupby(recent['date'].dt.weekday)['daily_all_vac'].mean()
+        by_weekday = by_weekday.reindex(range(7)).fillna(by_weekday.mean())
+        self.factors = tuple(float(v) for v in by_weekday / by_weekday.mean())
+
+    def apply(self, capacity, base, dates, start_pos):
+        return capacity * np.array(self.factors)[pd.DatetimeIndex(dates).weekday]
+
+
+class supply_cap():
+    """caps daily capacity at max_daily_doses (e.g. vaccine supply) between start_date and end_date, inclusive.
+    no dates caps the whole horizon"""
+
+    def __init__(self, max_daily_doses, start_date=None, end_date=None):
+        self.max_daily_doses = max_daily_doses
+        self.start_date = pd.Timestamp(start_date) if start_date is not None else None
+        self.end_date = pd.Timestamp(end_date) if end_date is not None else None
+
+    def apply(self, capacity, base, dates, start_pos):
+        dates = pd.DatetimeIndex(dates)
+        in_window = np.ones(len(dates), dtype=bool)
+        if self.start_date is not None:
+            in_window &= dates >= self.start_date
+        if self.end_date is not None:
+            in_window &= dates <= self.end_date
+        return np.where(in_window, np.minimum(capacity, self.max_daily_doses), capacity)
+
+
+class capacity_model():
+    """per day capacity built from the run rate by applying each component in turn, e.g.
+    capacity_model(exponential_growth(0.02), weekday_profile(vac_df), supply_cap(600000)). the whole horizon is worked
+    out with array operations up front and handed to the projection engine as a per day scale on the run rate"""
+
+    def __init__(self, *components):
+        self.components = components
+
+    def daily_capacity(self, base, dates, start_pos):
+        """capacity for each day in dates, base being the run rate and start_pos the first projected day"""
+        capacity = np.full(len(dates), float(base))
+        for component in self.components:
+            capacity = component.apply(capacity, base, dates, start_pos)
+        return capacity
+
+    def key(self):
+        """hashable description of the components, for caching projections"""
+        return tuple((type(component).__name__, tuple(sorted((k, str(v)) for k, v in vars(component).items())))
+                     for component in self.components)
@@ -0,0 +1,185 @@
+"""Cohort based projection for any number of doses (first, second, boosters...).
+
+Each dose stage after the first keeps a fixed width ring of people waiting by due day (width = longest interval + 1)
+and a count of people already due but not yet seen. Every simulated day all stages are advanced together with array
+operations: the day's due cohorts join the overdue queues, capacity is shared out across the stages in priority order
+(each stage optionally limited to a share of the day's capacity), first doses take what's left up to the eligible
+population, and each stage's doses schedule the next stage interval days later. State is bounded by the ring width
+whatever the horizon, and many capacity realisations run side by side.
+
+    stages = [dose_stage('first_dose'),
+              dose_stage('second_dose', interval_days=91),
+              dose_stage('booster', interval_days=182, uptake=0.8, max_share=0.5)]
+    cohorts = cohort_projection(actual_data, stages, end_date='31/12/2022')
+    cohorts_df = cohorts.to_frame(cohorts.simulate())
+"""
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import projection_engine
+
+
+class dose_stage():
+    """one dose. interval_days after the previous dose it falls due, uptake is the share of the previous dose's
+    recipients who come back for it, lower priority is served first (default: later doses first, like the two dose
+    projection) and max_share caps the share of a day's capacity the stage can use"""
+
+    def __init__(self, name, interval_days=0, uptake=1.0, priority=None, max_share=1.0):
+        self.name = name
+        self.interval_days = interval_days
+        self.uptake = uptake
+        self.priority = priority
+        self.max_share = max_share
+
+
+def default_stages(interval_days=91):
+    """first and second doses, the second falling due about 3 months later"""
+    return [dose_stage('first_dose'), dose_stage('second_dose', interval_days=interval_days)]
+
+
+def advance_cohorts(capacity, intervals, uptake, order, max_share, rings, overdue, remaining_first):
+    """run the cohort simulation over capacity, a (realisations, days) array.
+
+    intervals/uptake/max_share are per stage, order lists the stages by priority. rings (realisations, stages, width)
+    holds the people falling due on each future day by day mod width, overdue (realisations, stages) those already
+    due and remaining_first (realisations,) who can still have a first dose; all three are updated in place.
+
+    Returns daily doses and the overdue queue at the end of each day, both (realisations, stages, days)"""
+    n_runs, n_days = capacity.shape
+    n_stages = len(intervals)
+    width = rings.shape[2]
+    doses = np.zeros((n_runs, n_stages, n_days))
+    queued = np.zeros((n_runs, n_stages, n_days))
+    next_stages = np.arange(1, n_stages)
+
+    for t in range(n_days):
+        slot = t % width
+        overdue += rings[:, :, slot]
+        rings[:, :, slot] = 0
+        demand = overdue.copy()
+        demand[:, 0] = remaining_first
+
+        # share the day's capacity out in priority order
+        day_capacity = capacity[:, t][:, None]
+        demand = np.minimum(demand, max_share * day_capacity)[:, order]
+        served = np.clip(day_capacity - (np.cumsum(demand, axis=1) - demand), 0, demand)
+        doses[:, order, t] = served
+        served = doses[:, :, t]
+
+        overdue[:, 1:] -= served[:, 1:]
+        remaining_first -= served[:, 0]
+        rings[:, next_stages, (t + intervals[1:]) % width] += served[:, :-1] * uptake[1:]
+        queued[:, :, t] = overdue
+        queued[:, 0, t] = remaining_first
+    return doses, queued
+
+
+class cohort_projection():
+    """N dose projection from current_vaccine_data. actual first and second doses seed the queues: each day's
+    historical doses fall due for the next stage interval days later, less the next doses already given (earliest due
+    first). eligible_population (default the target) caps first doses. end_date is dd/mm/yyyy, default
+    orig_target_date. capacity defaults to the run rate of run_rate_window, shaped by capacity_model if given"""
+
+    def __init__(self, actual_data_obj, stages=None, end_date=None, run_rate_window="weekly_avg",
+                 eligible_population=None, capacity_model=None):
+        self.actual_data = actual_data_obj
+        self.stages = stages if stages is not None else default_stages()
+        if any(stage.interval_days < 1 for stage in self.stages[1:]):
+            raise ValueError("doses after the first need an interval of at least a day")
+
+        end_date = datetime.strptime(end_date, '%d/%m/%Y') if end_date is not None else self.actual_data.orig_target_date
+        self.dates = pd.date_range(self.actual_data.today, periods=max((end_date - self.actual_data.today).days, 0),
+                                   freq='D')
+        self.eligible_population = eligible_population if eligible_population is not None else self.actual_data.target_val
+        self.run_rate = {"weekly_avg": self.actual_data.daily_avg_week,
+                         "monthly_avg": self.actual_data.daily_avg_1month,
+                         "3_month_avg": self.actual_data.daily_avg_3month}[run_rate_window][0]
+        self.capacity_model = capacity_model
+
+        self.intervals = np.array([stage.interval_days for stage in self.stages], dtype=np.int64)
+        self.uptake = np.array([stage.uptake for stage in self.stages], dtype=np.float64)
+        self.max_share = np.array([stage.max_share for stage in self.stages], dtype=np.float64)
+        priorities = [stage.priority if stage.priority is not None else -i for i, stage in enumerate(self.stages)]
+        self.order = np.argsort(priorities, kind='stable')
+        self.width = int(self.intervals.max()) + 1
+
+    def actual_doses(self):
+        """cumulative doses given so far for each stage, (stages, actual days). stages beyond the feed are zero"""
+        vac_df = self.actual_data.vac_df
+        cumulative = np.zeros((len(self.stages), len(vac_df)))
+        cumulative[0] = vac_df['cumu_first_dose'].values
+        if len(self.stages) > 1:
+            cumulative[1] = vac_df['cumu_second_dose'].values
+        return cumulative
+
+    def initial_state(self):
+        """rings, overdue queue and remaining first doses at today, from the actuals"""
+        cumulative = self.actual_doses()
+        daily = np.diff(cumulative, axis=1, prepend=0)
+        # day offset of each actual day from today, negative in the past
+        offsets = (self.actual_data.vac_df['date'].values - np.datetime64(self.dates[0])) // np.timedelta64(1, 'D')
+
+        rings = np.zeros((len(self.stages), self.width))
+        overdue = np.zeros(len(self.stages))
+        for k in range(1, len(self.stages)):
+            # earliest dues are the ones already given
+            falling_due = daily[k - 1] * self.uptake[k]
+            given_before = np.cumsum(falling_due) - falling_due
+            falling_due = np.clip(falling_due - np.maximum(cumulative[k, -1] - given_before, 0), 0, None)
+            due_offsets = offsets + self.intervals[k]
+            overdue[k] = falling_due[due_offsets <= 0].sum()
+            future = due_offsets > 0
+            np.add.at(rings[k], due_offsets[future] % self.width, falling_due[future])
+        remaining_first = max(self.eligible_population - cumulative[0, -1], 0)
+        return rings, overdue, remaining_first, cumulative[:, -1]
+
+    def daily_capacity(self):
+        if self.capacity_model is None:
+            return np.full(len(self.dates), self.run_rate)
+        return self.capacity_model.daily_capacity(self.run_rate, self.dates, 0)
+
+    def simulate(self, capacity=None):
+        """run the projection. capacity is a scalar, a per day (days,) vector or (realisations, days); default the
+        run rate (shaped by capacity_model). returns a dict of (realisations, stages, days) arrays: daily doses,
+        cumulative doses and the queue at the end of each day (people due but not yet seen, and for first doses
+        the eligible people still without one)"""
+        capacity = self.daily_capacity() if capacity is None else capacity
+        capacity = np.atleast_2d(np.broadcast_to(np.asarray(capacity, dtype=np.float64), (len(self.dates),))
+                                 if np.ndim(capacity) < 2 else np.asarray(capacity, dtype=np.float64))
+        n_runs = capacity.shape[0]
+
+        rings, overdue, remaining_first, given = self.initial_state()
+        rings = np.tile(rings, (n_runs, 1, 1))
+        overdue = np.tile(overdue, (n_runs, 1))
+        remaining_first = np.full(n_runs, remaining_first)
+
+        doses, queued = advance_cohorts(capacity, self.intervals, self.uptake, self.order, self.max_share, rings,
+                                        overdue, remaining_first.copy())
+        cumulative = given[None, :, None] + np.cumsum(doses, axis=2)
+        # first doses from what's left of the eligible population, so reaching the cap lands on it exactly rather
+        # than a float sum just short of it
+        cumulative[:, 0] = given[0] + (remaining_first[:, None] - queued[:, 0])
+        return {'daily': doses,
+                'cumulative': cumulative,
+                'queued': queued}
+
+    def target_hit_dates(self, result, target_val=None):
+        """date cumulative first doses reach target_val (default the actual_data target) per realisation, NaT if
+        they don't within the horizon"""
+        target_val = self.actual_data.target_val if target_val is None else target_val
+        hit_pos = projection_engine.first_crossing(result['cumulative'][:, 0], target_val)
+        hit = hit_pos >= 0
+        hit_dates = pd.Series(pd.NaT, index=range(len(hit_pos)), dtype='datetime64[ns]')
+        hit_dates[hit] = self.dates[hit_pos[hit]]
+        return hit_dates
+
+    def to_frame(self, result, run=0):
+        """one realisation of a simulate result as a df: date, then daily_/cumu_/queued_ columns per stage"""
+        frame = {'date': self.dates}
+        for k, stage in enumerate(self.stages):
+            frame[f'daily_{stage.name}'] = result['daily'][run, k]
+            frame[f'cumu_{stage.name}'] = result['cumulative'][run, k]
+            frame[f'queued_{stage.name}'] = result['queued'][run, k]
+        return pd.DataFrame(frame)
@@ -0,0 +1,94 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from vaccination_data import current_vaccine_data
+
+KEY_COLUMNS = ['areaType', 'areaName', 'areaCode', 'date']
+METRIC_COLUMNS = ['newPeopleVaccinatedFirstDoseByPublishDate', 'cumPeopleVaccinatedFirstDoseByPublishDate',
+                  'newPeopleVaccinatedSecondDoseByPublishDate', 'cumPeopleVaccinatedSecondDoseByPublishDate']
+# metrics are read as float64 so blank days don't break a chunk, cumulative columns go back to int64 per area
+FEED_DTYPES = {'areaType': 'category',
+               'areaName': 'category',
+               'areaCode': 'category',
+               **{col: 'float64' for col in METRIC_COLUMNS}}
+
+
+def iter_csv_chunks(fname, chunksize=100000):
+    """read a long format govt csv chunksize rows at a time, only the key and metric columns"""
+    return pd.read_csv(fname, usecols=KEY_COLUMNS + METRIC_COLUMNS, dtype=FEED_DTYPES, chunksize=chunksize)
+
+
+def read_json_page(location):
+    with open(location) as f:
+        return json.load(f)
+
+
+def iter_json_pages(first_page, opener=read_json_page):
+    """walk a paginated govt api style json source, one df per page. each page is {"data": [...], "pagination":
+    {"next": ...}}; next is resolved relative to the current page, so a directory of page files stands in for the
+    api. opener fetches and parses one page, swap it for an http fetcher to read the live api"""
+    location = first_page
+    while location:
+        page = opener(location)
+        records = page.get('data') or []
+        yield pd.DataFrame.from_records(records, columns=KEY_COLUMNS + METRIC_COLUMNS).astype(FEED_DTYPES)
+        next_page = (page.get('pagination') or {}).get('next')
+        if next_page and opener is read_json_page:
+            next_page = os.path.join(os.path.dirname(location), next_page)
+        location = next_page
+
+
+class area_series_builder():
+    """builds per area time series from a feed a chunk at a time. each chunk is filtered to the requested areas and
+    cut down to date plus the metric columns before anything is kept, so peak memory is one chunk plus the kept
+    series, however big the feed"""
+
+    def __init__(self, area_types=None, area_codes=None):
+        self.area_types = set(area_types) if area_types is not None else None
+        self.area_codes = set(area_codes) if area_codes is not None else None
+        self.pieces = {}
+        self.area_names = {}
+
+    def add_chunk(self, chunk):
+        if self.area_types is not None:
+            chunk = chunk[chunk['areaType'].isin(self.area_types)]
+        if self.area_codes is not None:
+            chunk = chunk[chunk['areaCode'].isin(self.area_codes)]
+        if chunk.empty:
+            return
+
+        chunk = chunk.assign(date=pd.to_datetime(chunk['date'], dayfirst=True))
+        for area_code, area_chunk in chunk.groupby('areaCode', observed=True, sort=False):
+            self.area_names.setdefault(area_code, str(area_chunk['areaName'].iloc[0]))
+            self.pieces.setdefault(area_code, []).append(area_chunk[['date'] + METRIC_COLUMNS].reset_index(drop=True))
+
+    def series(self):
+        """dict of areaCode -> df in govt column layout, oldest first, one row per date (later rows win)"""
+        result = {}
+        for area_code, pieces in self.pieces.items():
+            area_df = pd.concat(pieces, ignore_index=True)
+            area_df = area_df.drop_duplicates(subset='date', keep='last').sort_values(by=['date']).reset_index(drop=True)
+            for col in METRIC_COLUMNS:
+                if col.startswith('cum') and not area_df[col].isna().any():
+                    area_df[col] = area_df[col].astype(np.int64)
+            area_df.insert(0, 'areaName', self.area_names[area_code])
+            result[area_code] = area_df
+        return result
+
+
+def stream_area_feeds(source, area_types=None, area_codes=None, chunksize=100000):
+    """per area time series from a long format csv (read in chunks) or the first page of a paginated json source"""
+    builder = area_series_builder(area_types, area_codes)
+    chunks = iter_json_pages(source) if source.endswith('.json') else iter_csv_chunks(source, chunksize)
+    for chunk in chunks:
+        builder.add_chunk(chunk)
+    return builder.series()
+
+
+def load_area_actuals(source, area_code='K02000001', chunksize=100000, **target_kwargs):
+    """current_vaccine_data for one area of a streamed feed. target_kwargs go to current_vaccine_data"""
+    area_df = stream_area_feeds(source, area_codes=[area_code], chunksize=chunksize)[area_code]
+    return current_vaccine_data.from_frames(area_df, area_df, **target_kwargs)
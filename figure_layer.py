@@ -0,0 +1,47 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from projection_data import scenario_cache
+
+PLOTS = ['daily_doses_projection_plot', 'cumulative_doses_plot', 'second_doses_by_month_perc_plot',
+         'second_dose_backlog_daily_plot', 'second_dose_backlog_cumu_plot']
+
+# finished figures keyed by what they were built from, kept across dashboard reruns
+figure_cache = scenario_cache(maxsize=64)
+
+
+def figure_keys(projection):
+    """cache key per figure: the projection's scenario key for the projection plots (None, so never cached, for
+    unseeded randomised runs) and the actuals' data version for the waffle chart, which only depends on the actuals"""
+    scenario = projection.scenario_key()
+    keys = {plot: (scenario, plot) if scenario is not None else None for plot in PLOTS}
+    keys['waffle_chart'] = (projection.actual_data.data_version(), 'waffle_chart')
+    return keys
+
+
+def figure_builders(projection):
+    builders = {plot: getattr(projection, plot) for plot in PLOTS}
+    builders['waffle_chart'] = projection.actual_data.plot_waffle_chart
+    return builders
+
+
+def build_figures(projection, n_workers=None, cache=figure_cache):
+    """all dashboard figures for a finished projection, as a dict keyed by plot name (plus 'waffle_chart'). figures
+    already in the cache for the same inputs are reused, the rest are built concurrently on a thread pool"""
+    keys = figure_keys(projection)
+    builders = figure_builders(projection)
+
+    figures = {}
+    for name, key in keys.items():
+        figure = cache.get(key) if cache is not None and key is not None else None
+        if figure is not None:
+            figures[name] = figure
+
+    todo = [name for name in builders if name not in figures]
+    if todo:
+        with ThreadPoolExecutor(max_workers=n_workers or len(todo)) as executor:
+            built = dict(zip(todo, executor.map(lambda name: builders[name](), todo)))
+        for name, figure in built.items():
+            figures[name] = figure
+            if cache is not None:
+                cache.put(keys[name], figure)
+    return figures
@@ -0,0 +1,140 @@
+"""Goal seek: the daily capacity, or the dosing interval, needed to hit the first dose target by a deadline.
+
+    from goal_seek import required_capacity, required_interval
+    required_capacity(actual_data)                            # by orig_target_date
+    required_capacity(actual_data, deadline='31/08/2021')     # by rev_target_date
+    required_interval(actual_data, capacity=700000)
+
+Capacity is found by batched bisection: each round projects a row of candidate capacities at once (closed form path,
+falling back to the batched engine where second doses overflow), finds the first candidate whose cumulative first
+doses cross the target before the deadline and narrows the bracket to either side of it.
+
+Missing the target and second dose overflow running out of horizon (an exhausted projection, which isn't a valid
+result) are kept apart: exhausted candidates count as not hitting, and the result's overflow_infeasible says when the
+capacity returned is the edge of exhaustion rather than of missing the target.
+"""
+import copy
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from projection_data import projected_data
+from scenario_sweep import interval_offset, interval_label, project_realisations
+import projection_engine
+
+
+def deadline_projection(actual_data, deadline=None, run_rate_window="weekly_avg", dose_interval=None,
+                        capacity_model=None):
+    """an empty fixed capacity projection running up to deadline (dd/mm/yyyy, None for orig_target_date) and the
+    engine inputs for it"""
+    deadline_data = copy.copy(actual_data)
+    if deadline is not None:
+        deadline_data.orig_target_date = datetime.strptime(deadline, '%d/%m/%Y')
+        deadline_data.set_today(actual_data.today)
+    projection = projected_data(deadline_data, run_rate_window=run_rate_window, randomise_daily_capacity="False",
+                                cache=None, dose_interval=interval_offset(dose_interval), capacity_model=capacity_model)
+    projection.get_capacity()
+    projection.create_empty_projected_df()
+    return projection, projection.projection_inputs()
+
+
+def evaluate_capacities(projection, inputs, capacities, target_val):
+    """target hit position (-1 if not hit in the horizon or exhausted), peak backlog and whether the projection was
+    exhausted (overflow ran out of horizon, so no valid result) for each fixed daily capacity"""
+    capacities = np.asarray(capacities, dtype=np.float64)
+    n_days = len(inputs['dates'])
+    if projection.capacity_model is None:
+        day_scale = np.ones((len(capacities), n_days))
+    else:
+        # the model is applied to each candidate, so absolute parts like supply caps hold whatever the base
+        start_pos = int(np.argmin(inputs['is_actual'])) if not inputs['is_actual'].all() else n_days
+        day_scale = np.array([projection.capacity_model.daily_capacity(capacity, inputs['dates'], start_pos) / capacity
+                              for capacity in capacities])
+    visit_capacities = np.repeat(capacities[:, None], len(inputs['order']), axis=1)
+
+    first, second = project_realisations(inputs, visit_capacities, day_scale, np.ones(len(capacities), dtype=bool))
+    cumu_first = projection_engine.fill_cumulative(first, inputs['cumu_first_dose'])
+    cumu_second = projection_engine.fill_cumulative(second, inputs['cumu_second_dose'])
+    hit_pos = projection_engine.first_crossing(cumu_first, target_val)
+    exhausted = np.isnan(cumu_first).any(axis=1)
+    with np.errstate(invalid='ignore'):
+        peak_backlog = np.max(cumu_first - cumu_second, axis=1)
+    return hit_pos, peak_backlog, exhausted
+
+
+def solution(projection, inputs, capacity, hit_pos, peak_backlog, **extra):
+    return {'capacity': capacity,
+            'run_rate': projection.capacity,
+            'capacity_multiplier': capacity / projection.capacity if capacity is not None else None,
+            'deadline': pd.Timestamp(projection.actual_data.orig_target_date),
+            'target_hit_date': pd.Timestamp(inputs['dates'][hit_pos]) if hit_pos >= 0 else pd.NaT,
+            'peak_backlog': float(peak_backlog) if capacity is not None else None,
+            **extra}
+
+
+def required_capacity(actual_data, deadline=None, target_val=None, run_rate_window="weekly_avg", dose_interval=None,
+                      capacity_model=None, tol=1000, n_probe=32, max_multiplier=20):
+    """lowest fixed daily capacity (to within tol doses a day) that gets cumulative first doses to target_val (default
+    the actual_data target) before deadline (dd/mm/yyyy, default orig_target_date). dose_interval in weeks, None for
+    the default. with a capacity_model the returned capacity is the base its components are applied to.
+
+    Returns a dict with the capacity, its multiple of the run rate, the target hit date and peak backlog it gives.
+    capacity is None if even max_multiplier times the run rate (or 10M a day) misses the deadline. overflow_infeasible
+    is True when the capacity just below the one returned is exhausted rather than missing the target: the capacity
+    is then the lowest with a valid projection that hits, and lower ones may reach the target with second doses the
+    model can't place before the horizon ends"""
+    target_val = actual_data.target_val if target_val is None else target_val
+    projection, inputs = deadline_projection(actual_data, deadline, run_rate_window, dose_interval, capacity_model)
+
+    lo, hi = 0.0, max(projection.capacity * max_multiplier, 1e7)
+    hit_pos, peak_backlog, exhausted = evaluate_capacities(projection, inputs, [hi], target_val)
+    if hit_pos[0] < 0:
+        return solution(projection, inputs, None, -1, None, overflow_infeasible=bool(exhausted[0]))
+    best = (hi, hit_pos[0], peak_backlog[0])
+    lo_exhausted = False
+
+    while hi - lo > tol:
+        candidates = np.linspace(lo, hi, n_probe + 2)[1:-1]
+        hit_pos, peak_backlog, exhausted = evaluate_capacities(projection, inputs, candidates, target_val)
+        hits = np.flatnonzero(hit_pos >= 0)
+        if not len(hits):
+            lo, lo_exhausted = candidates[-1], exhausted[-1]
+            continue
+        k = hits[0]
+        best = (candidates[k], hit_pos[k], peak_backlog[k])
+        if k > 0:
+            lo, lo_exhausted = candidates[k - 1], exhausted[k - 1]
+        hi = candidates[k]
+
+    return solution(projection, inputs, float(best[0]), best[1], best[2], overflow_infeasible=bool(lo_exhausted))
+
+
+def required_interval(actual_data, capacity=None, deadline=None, target_val=None, run_rate_window="weekly_avg",
+                      intervals=range(3, 27), capacity_model=None):
+    """shortest dosing interval (weeks, from intervals) that hits target_val before deadline at a fixed daily capacity
+    (default the run rate). longer intervals push second doses back and leave more capacity for first doses.
+
+    Returns a dict like required_capacity's with dose_interval_weeks, None if no interval in the range hits.
+    overflow_infeasible is True if a shorter interval was skipped because its projection was exhausted rather than
+    because it missed the target"""
+    target_val = actual_data.target_val if target_val is None else target_val
+    any_exhausted = False
+    for weeks in sorted(intervals):
+        projection, inputs = deadline_projection(actual_data, deadline, run_rate_window, weeks, capacity_model)
+        daily_capacity = projection.capacity if capacity is None else capacity
+        hit_pos, peak_backlog, exhausted = evaluate_capacities(projection, inputs, [daily_capacity], target_val)
+        if hit_pos[0] >= 0:
+            return solution(projection, inputs, float(daily_capacity), hit_pos[0], peak_backlog[0],
+                            dose_interval_weeks=weeks, overflow_infeasible=any_exhausted)
+        any_exhausted |= bool(exhausted[0])
+    return solution(projection, inputs, None, -1, None, dose_interval_weeks=None, overflow_infeasible=any_exhausted)
+
+
+def capacity_by_interval(actual_data, intervals=(None, 8, 10, 12), **kwargs):
+    """required_capacity for each dosing interval, as a table. kwargs go to required_capacity"""
+    rows = []
+    for interval in intervals:
+        result = required_capacity(actual_data, dose_interval=interval, **kwargs)
+        rows.append({'dose_interval': interval_label(interval_offset(interval)), **result})
+    return pd.DataFrame(rows)
@@ -0,0 +1,88 @@
+import numpy as np
+import pandas as pd
+from datetime import timedelta
+
+from vaccination_data import FEED_COLUMNS, DOSE_INTERVAL, STAT_COLUMNS
+from projection_data import projected_data
+
+ACTUAL_COLUMNS = ['daily_first_dose', 'daily_second_dose', 'cumu_first_dose', 'cumu_second_dose', 'vac_backlog',
+                  'daily_all_vac']
+
+
+class incremental_projection():
+    """keeps a projection up to date as new days of actuals are published, rather than rebuilding current_vaccine_data
+    and projected_data from the csvs. the run rate index is extended in place (O(new days), plus the days after any
+    revised one) and the run rates are read off it in O(1). writing the rows into vac_df and projected_df and rerunning
+    the projection engine are still O(rows) per update; the engine rerun dominates"""
+
+    def __init__(self, actual_data_obj, run_rate_window="weekly_avg", randomise_daily_capacity="False", std_dev=0.1):
+        self.actual_data = actual_data_obj
+        self.roll_forward()
+        self.projection = projected_data(self.actual_data, run_rate_window=run_rate_window,
+                                         randomise_daily_capacity=randomise_daily_capacity, std_dev=std_dev)
+        self.projection.collate_and_project_data()
+
+    def roll_forward(self):
+        """move today to the day after the latest actuals and update the run rates"""
+        index = self.actual_data.run_rate_index
+        self.actual_data.set_today(pd.Timestamp(index.dates[-1]) + timedelta(days=1))
+        for name, rates in index.run_rates(self.actual_data.today).items():
+            setattr(self.actual_data, name, tuple(rates[0]))
+
+    def update(self, new_rows):
+        """take new rows of actuals (govt feed columns for both doses side by side) and bring the projection up to date.
+        rows can revise days already held or follow on from the latest day, with no gaps"""
+        new_rows = new_rows.rename(columns=FEED_COLUMNS)
+        new_rows['date'] = pd.to_datetime(new_rows['date'], dayfirst=True)
+        new_rows = new_rows.sort_values(by=['date']).reset_index(drop=True)
+        new_rows['vac_backlog'] = new_rows['cumu_first_dose'] - new_rows['cumu_second_dose']
+        new_rows['daily_all_vac'] = new_rows['daily_first_dose'] + new_rows['daily_second_dose']
+
+        index = self.actual_data.run_rate_index
+        n_actual = len(index.dates)
+        positions = (new_rows['date'] - pd.Timestamp(index.dates[0])).dt.days.values
+        appended = positions >= n_actual
+        if np.any(positions[appended] != np.arange(n_actual, n_actual + appended.sum())):
+            raise ValueError("new actuals must revise days already held or follow on from the latest day without gaps")
+        if np.any(positions < 0) or positions.max() >= len(self.projection.projected_df):
+            raise ValueError("new actuals fall outside the projection horizon")
+
+        # the index holds the feed's own stats, the first row before the one-off prior allocation
+        stat_values = new_rows[STAT_COLUMNS].values.astype(np.float64)
+        for pos, values in zip(positions[~appended], stat_values[~appended]):
+            index.revise(pos, values)
+        index.append(new_rows.loc[appended, 'date'].values, stat_values[appended])
+        unadjusted_first_row = tuple(stat_values[positions == 0][0, 1:]) if (positions == 0).any() else \
+            self.actual_data.unadjusted_first_row
+
+        self.update_actual_rows(new_rows, positions, appended)
+        self.actual_data.unadjusted_first_row = unadjusted_first_row
+        self.roll_forward()
+        self.actual_data.create_waffle_data()
+
+        self.projection.daily_avg_3month = self.actual_data.daily_avg_3month[0]
+        self.projection.daily_avg_1month = self.actual_data.daily_avg_1month[0]
+        self.projection.daily_avg_week = self.actual_data.daily_avg_week[0]
+        self.projection.get_capacity()
+        self.projection.project_data()
+        self.projection.complete_projection_df()
+
+    def update_actual_rows(self, new_rows, positions, appended):
+        """write the new rows into vac_df and turn the matching projected rows into actuals"""
+        vac_df = self.actual_data.vac_df
+        revised = new_rows[~appended]
+        vac_df.loc[positions[~appended], ACTUAL_COLUMNS] = revised[ACTUAL_COLUMNS].values
+        added = new_rows.loc[appended, ['date'] + ACTUAL_COLUMNS]
+        added['areaName'] = vac_df['areaName'].iloc[0]
+        added['second_vac_cutoff'] = added['date'] + DOSE_INTERVAL
+        vac_df = pd.concat([vac_df, added[vac_df.columns]], ignore_index=True)
+
+        projected_df = self.projection.projected_df
+        projected_df.loc[positions, ACTUAL_COLUMNS] = new_rows[ACTUAL_COLUMNS].values
+        projected_df.loc[positions, 'status'] = 'actual'
+
+        # the one-off prior allocation on the first day depends on the latest cumulative second doses
+        self.actual_data.vac_df = vac_df
+        self.actual_data.adjust_prior_data()
+        projected_df.loc[0, 'daily_first_dose'] = vac_df.loc[0, 'daily_first_dose']
+        projected_df.loc[0, 'daily_second_dose'] = vac_df.loc[0, 'daily_second_dose']
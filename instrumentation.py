@@ -0,0 +1,82 @@
+import json
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+
+def reset_traced_peak():
+    """start the peak traced memory afresh. tracemalloc.reset_peak is python 3.9+, before that tracing is restarted,
+    which also drops the traces taken so far"""
+    if hasattr(tracemalloc, 'reset_peak'):
+        tracemalloc.reset_peak()
+    else:
+        tracemalloc.stop()
+        tracemalloc.start()
+
+
+class memory_sink():
+    """keeps every record in a list, e.g. for a debug panel"""
+
+    def __init__(self):
+        self.records = []
+
+    def write(self, record):
+        self.records.append(record)
+
+
+class jsonl_sink():
+    """appends each record to a file as one json line"""
+
+    def __init__(self, fname):
+        self.fname = fname
+
+    def write(self, record):
+        with open(self.fname, 'a') as f:
+            f.write(json.dumps(record, default=str) + '\n')
+
+
+class instrumentation():
+    """per stage wall time (and peak traced memory with trace_memory, which slows the stages it measures) plus named
+    counters. a run's stages and counters are written to the sink as one record on flush. any object with a
+    write(record) method can be a sink. code being measured holds None when instrumentation is off, so the only cost
+    then is an is None check per stage"""
+
+    def __init__(self, sink=None, trace_memory=False, clock=time.perf_counter):
+        self.sink = sink if sink is not None else memory_sink()
+        self.trace_memory = trace_memory
+        self.clock = clock
+        self.stages = {}
+        self.counters = {}
+
+    @contextmanager
+    def stage(self, name):
+        started_tracing = False
+        if self.trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                started_tracing = True
+            reset_traced_peak()
+        start = self.clock()
+        try:
+            yield
+        finally:
+            stage = self.stages.setdefault(name, {'seconds': 0.0, 'calls': 0})
+            stage['seconds'] += self.clock() - start
+            stage['calls'] += 1
+            if self.trace_memory:
+                peak = tracemalloc.get_traced_memory()[1]
+                stage['peak_memory_bytes'] = max(stage.get('peak_memory_bytes', 0), peak)
+                if started_tracing:
+                    tracemalloc.stop()
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def flush(self, **context):
+        """write the stages and counters gathered since the last flush, tagged with context, and reset. returns the
+        record"""
+        record = {'timestamp': time.time(), **context, 'stages': self.stages, 'counters': self.counters}
+        self.sink.write(record)
+        self.stages = {}
+        self.counters = {}
+        return record
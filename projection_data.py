@@ -1,25 +1,92 @@
-import copy
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
 import numpy as np
 import pandas as pd
 from datetime import date, datetime, timedelta
 from dateutil.relativedelta import relativedelta
-import matplotlib.pyplot as plt
-from pywaffle import Waffle
-import plotly.graph_objects as go
 
-from vaccination_data import current_vaccine_data
+from vaccination_data import current_vaccine_data, DOSE_INTERVAL
+import projection_engine
+from shared_arrays import shared_arrays
+
+
+class scenario_cache():
+    """bounded LRU of finished projections keyed by scenario, with hit/miss counters"""
+
+    def __init__(self, maxsize=32):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        if key is not None and key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key]
+        self.misses += 1
+        return None
+
+    def put(self, key, entry):
+        if key is None:
+            return
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self.entries), 'maxsize': self.maxsize}
+
+
+projection_cache = scenario_cache()
+
 
 class projected_data():
+    # daily bar charts over longer horizons are rolled up to weeks, longer line charts are drawn with webgl
+    max_plot_points = 400
 
-    def __init__(self, actual_data_obj, run_rate_window= "weekly_avg", randomise_daily_capacity="True", std_dev=0.1):
+    def __init__(self, actual_data_obj, run_rate_window= "weekly_avg", randomise_daily_capacity="True", std_dev=0.1, seed=None,
+                 cache=projection_cache, dose_interval=DOSE_INTERVAL, capacity_model=None, instrument=None):
         self.actual_data = actual_data_obj
-        self.projected_df = copy.deepcopy(self.actual_data.vac_df)
+        # columns are only ever added to or replaced on projected_df, so a shallow copy is enough and the actuals
+        # aren't copied per projection
+        self.projected_df = self.actual_data.vac_df.copy(deep=False)
         self.daily_avg_3month = self.actual_data.daily_avg_3month[0]
         self.daily_avg_1month = self.actual_data.daily_avg_1month[0]
         self.daily_avg_week = self.actual_data.daily_avg_week[0]
         self.randomise_daily_capacity = randomise_daily_capacity
         self.randomise_std_dev = std_dev
         self.run_rate_window = run_rate_window
+        self.seed = seed
+        self.cache = cache
+        self.dose_interval = dose_interval
+        self.capacity_model = capacity_model
+        self.instrument = instrument
+
+    def stage(self, name):
+        """time a stage on the instrumentation, if any"""
+        return self.instrument.stage(name) if self.instrument is not None else nullcontext()
+
+    def count(self, name, value=1):
+        if self.instrument is not None:
+            self.instrument.count(name, value)
+
+    def flush_metrics(self, **context):
+        """write the stages and counters gathered so far to the instrumentation sink as one record, tagged with the
+        scenario. returns the record, None without instrumentation"""
+        if self.instrument is None:
+            return None
+        return self.instrument.flush(run_rate_window=self.run_rate_window,
+                                     randomise_daily_capacity=self.randomise_daily_capacity,
+                                     std_dev=self.randomise_std_dev, seed=self.seed,
+                                     dose_interval=str(self.dose_interval), **context)
 
     def get_capacity(self):
         """set a capacity value to base projections on"""
@@ -36,167 +103,307 @@ class projected_data():
         s = np.random.normal(mu, sigma, 1)
         return s[0]
 
+    @staticmethod
+    def gen_rand_vars(mu=0, sigma=0.1, size=1):
+        """gen an array of random vals from a normal distribution in one draw. same stream as repeated gen_rand_var calls"""
+        return np.random.normal(mu, sigma, size)
+
     def create_empty_projected_df(self):
         """takes the actual vac_df data, augments with extra columns and then adds an empty projected row for every day
-        remaining between now and target"""
+        remaining between now and target. the projected rows are built as one block and joined on in a single concat"""
         self.projected_df['status'] = 'actual'
-        self.projected_df['processed'] = 'False'
-        self.projected_df['due_by_today'] = 0
-        self.projected_df['sd_overflow'] = 0
-        self.projected_df['falling_due_allocated'] = 'NA'
-        self.projected_df['day_filled'] = 'True'
-
-        # add a row for each day between now and target
-        for i in range(self.actual_data.diff_1.days):
-            new_date = self.actual_data.today + relativedelta(days=i)
-            # initilise with empty values but correct dates in future
-            row = {'date': new_date,
-                   'areaName': 'United Kingdom',
-                   'daily_first_dose': 0,
-                   'daily_second_dose': 0,
-                   'cumu_first_dose': 0,
-                   'cumu_second_dose': 0,
-                   'vac_backlog': 0,
-                   'daily_all_vac': 0,
-                   'second_vac_cutoff': new_date + relativedelta(months=3),
-                   'status': 'projected',
-                   'processed': 'False',
-                   'due_by_today': 0,
-                   'sd_overflow': 0,
-                   'falling_due_allocated': 'False',
-                   'day_filled': 'False'}
-            self.projected_df = self.projected_df.append(row, ignore_index=True)
-
-    def allocate_second_doses(self, date, adj_capacity):
-        """fill second doses on a given day, based on first doses distributed on the same day 3 months before. In the case
-        that a day has too many to process, seeks the first available slots in the day before, working backwards until
-        all scheduled vaccines are completed."""
-        amount_due = self.projected_df.loc[self.projected_df['date']==date, 'due_by_today'].values[0]
-        if amount_due > adj_capacity:
-            self.projected_df.loc[self.projected_df['date']==date, 'daily_second_dose'] = adj_capacity
-            self.projected_df.loc[self.projected_df['date']==date, 'day_filled'] = 'True'
-            overflow = amount_due - adj_capacity
-            day_before = date
-            self.projected_df.loc[self.projected_df['date']==date, 'processed'] = 'True'
-            while overflow > 0:
-                day_before = day_before - relativedelta(days=1)
-                if self.projected_df.loc[self.projected_df['date']==day_before, 'day_filled'].values[0] != 'True':
-                    currently_allocated = self.projected_df.loc[self.projected_df['date']==day_before, 'daily_second_dose'].values[0]
-                    remaining_availability = adj_capacity - currently_allocated
-                    if remaining_availability < overflow:
-                        filled = remaining_availability
-                        self.projected_df.loc[self.projected_df['date']==day_before, 'day_filled'] = 'True'
-                        self.projected_df.loc[self.projected_df['date']==day_before, 'processed'] = 'True'
-                    else:
-                        filled = overflow
-                    overflow -= filled
-                    self.projected_df.loc[self.projected_df['date']==day_before, 'daily_second_dose'] = currently_allocated + filled
-                    self.projected_df.loc[self.projected_df['date']==day_before, 'sd_overflow'] += filled
-                else:
-                    pass
-        else:
-            self.projected_df.loc[self.projected_df['date']==date, 'daily_second_dose'] = amount_due
-        self.projected_df.loc[self.projected_df['date']==date, 'falling_due_allocated'] = 'True'
-
-
-    def fill_falling_due(self, i):
-        """looks at first doses due to be administered. Schedules them for 3 months time"""
-        if self.projected_df.loc[i, 'processed'] == 'True':
-            pass
-        else:
-            due_date = self.projected_df.loc[i, 'second_vac_cutoff']
-            due = self.projected_df.loc[i, 'daily_first_dose']
-            self.projected_df.loc[self.projected_df['date']==due_date, 'due_by_today'] = due
-            self.projected_df.loc[i, 'processed'] = 'True'
-
-    def fill_remaining_space_fd(self, i, adj_capacity):
-        """once second doses are allocated, fill remaining space with first doses"""
-        if self.projected_df.loc[i, 'daily_second_dose'] >= adj_capacity or self.projected_df.loc[i, 'status'] == 'actual':
-            pass
-        else:
-            self.projected_df.loc[i, 'daily_first_dose'] = adj_capacity - self.projected_df.loc[i, 'daily_second_dose']
-            self.projected_df.loc[i, 'day_filled'] = 'True'
+        self.projected_df['processed'] = False
+        self.projected_df['due_by_today'] = 0.0
+        self.projected_df['sd_overflow'] = 0.0
+        self.projected_df['falling_due_allocated'] = pd.array([pd.NA] * len(self.projected_df), dtype='boolean')
+        self.projected_df['day_filled'] = True
+
+        # a row for each day between now and target, initilised with empty values but correct dates in future
+        new_dates = pd.date_range(self.actual_data.today, periods=max(self.actual_data.diff_1.days, 0), freq='D')
+        n_days = len(new_dates)
+        empty_df = pd.DataFrame({'areaName': self.projected_df['areaName'].iloc[0],
+                                 'date': new_dates,
+                                 'daily_first_dose': np.zeros(n_days),
+                                 'cumu_first_dose': np.zeros(n_days),
+                                 'daily_second_dose': np.zeros(n_days),
+                                 'cumu_second_dose': np.zeros(n_days),
+                                 'vac_backlog': np.zeros(n_days),
+                                 'daily_all_vac': np.zeros(n_days),
+                                 'second_vac_cutoff': new_dates + self.dose_interval,
+                                 'status': 'projected',
+                                 'processed': np.zeros(n_days, dtype=bool),
+                                 'due_by_today': np.zeros(n_days),
+                                 'sd_overflow': np.zeros(n_days),
+                                 'falling_due_allocated': pd.array(np.zeros(n_days, dtype=bool), dtype='boolean'),
+                                 'day_filled': np.zeros(n_days, dtype=bool)},
+                                columns=self.projected_df.columns)
+        self.projected_df = pd.concat([self.projected_df, empty_df], ignore_index=True)
+        if self.dose_interval != DOSE_INTERVAL:
+            self.projected_df['second_vac_cutoff'] = self.projected_df['date'] + self.dose_interval
 
     def create_date_filters(self):
-        """get a set of dates to work through projections with"""
-        months = ['january', 'february', 'march', 'april', 'may', 'june', 'july', 'august', 'september']
-        base_filter_date = '01/01/2021'
-        base_filter_date = datetime.strptime(base_filter_date, '%d/%m/%Y')
+        """get a set of month start dates to work through projections with, from the month of the first row to two
+        months past the last row so every row falls in a 2 month window"""
+        first_date = self.projected_df['date'].min()
+        last_date = self.projected_df['date'].max()
+        base_filter_date = datetime(first_date.year, first_date.month, 1)
+        n_months = (last_date.year - first_date.year) * 12 + (last_date.month - first_date.month) + 3
         filter_dict = {}
-        for i in range(len(months)):
-            filter_dict[months[i]] = base_filter_date + relativedelta(months=i)
+        for i in range(n_months):
+            filter_date = base_filter_date + relativedelta(months=i)
+            filter_dict[filter_date.strftime('%B_%Y').lower()] = filter_date
         self.filter_dict = filter_dict
 
+    def get_daily_capacities(self, n_visits):
+        """capacity for each day visited by the projection, randomised around the run rate if set"""
+        if self.randomise_daily_capacity == "True":
+            if self.seed is None:
+                rand_cap_adj = self.gen_rand_vars(mu=0, sigma=self.randomise_std_dev, size=n_visits)
+            else:
+                rand_cap_adj = np.random.RandomState(self.seed).normal(0, self.randomise_std_dev, n_visits)
+            return self.capacity + (rand_cap_adj * self.capacity)
+        return np.full(n_visits, self.capacity, dtype=np.float64)
+
+    def capacity_day_scale(self, inputs):
+        """per day scale on the run rate from capacity_model, None without one. the day capacities are kept in
+        daily_capacity"""
+        if self.capacity_model is None:
+            return None
+        is_actual = inputs['is_actual']
+        start_pos = int(np.argmin(is_actual)) if not is_actual.all() else len(is_actual)
+        self.daily_capacity = self.capacity_model.daily_capacity(self.capacity, inputs['dates'], start_pos)
+        return self.daily_capacity / self.capacity
+
+    def projection_inputs(self):
+        """arrays the projection engine works from, taken from the empty projection df. rows not yet actuals are
+        reset to empty so the inputs are the same before and after a projection has been run"""
+        self.create_date_filters()
+        dates = self.projected_df['date'].values
+        projection_engine.check_daily_index(dates)
+        is_actual = (self.projected_df['status'] == 'actual').values
+
+        return {'dates': dates,
+                'daily_first_dose': np.where(is_actual, self.projected_df['daily_first_dose'].values, 0),
+                'daily_second_dose': np.where(is_actual, self.projected_df['daily_second_dose'].values, 0),
+                'cumu_first_dose': np.where(is_actual, self.projected_df['cumu_first_dose'].values, 0),
+                'cumu_second_dose': np.where(is_actual, self.projected_df['cumu_second_dose'].values, 0),
+                'is_actual': is_actual,
+                'cutoff_pos': projection_engine.cutoff_positions(dates, self.projected_df['second_vac_cutoff'].values),
+                'order': projection_engine.visit_order(dates, list(self.filter_dict.values()))}
+
     def project_data(self):
         """run through empty projection df, taking 2 month windows of dates, projecting second vaccines falling due, allocating
         and then filling remaining space with first doses. works iteratively so that when a fd is filled, the corresponding sd
-        are put in the relavant row to be allocated 3 months later"""
-
-        self.create_date_filters()
-        months = list(self.filter_dict.keys())
-
-        for i in range(len(months) - 2):
-            valid_data = self.projected_df[self.projected_df['date'] < self.filter_dict[months[i + 2]]]
-            valid_data = valid_data[valid_data['date'] >= self.filter_dict[months[i]]]
-            for j in valid_data.index:
-                if self.randomise_daily_capacity == "True":
-                    rand_cap_adj = self.gen_rand_var(mu=0, sigma=self.randomise_std_dev)
-                    capacity_adj = self.capacity + (rand_cap_adj * self.capacity)
-                else:
-                    capacity_adj = self.capacity
-                self.fill_remaining_space_fd(j, capacity_adj)
-                self.fill_falling_due(j)
-                if valid_data.loc[j, 'second_vac_cutoff'] < self.projected_df.date.max():
-                    self.allocate_second_doses(valid_data.loc[j, 'second_vac_cutoff'], capacity_adj)
+        are put in the relavant row to be allocated 3 months later. the work is done on numpy arrays indexed by day offset
+        (see projection_engine) and written back to projected_df in one go. a fixed capacity takes the closed form path
+        and only steps through the visits when second doses overflow"""
+
+        inputs = self.projection_inputs()
+        day_scale = self.capacity_day_scale(inputs)
+        projection = None
+        if self.randomise_daily_capacity != "True":
+            fixed = projection_engine.project_days_fixed(inputs['daily_first_dose'], inputs['daily_second_dose'],
+                                                         inputs['is_actual'], inputs['cutoff_pos'], inputs['order'],
+                                                         self.capacity, day_scale)
+            if not fixed['overflowed'][0]:
+                projection = {col: values[0] for col, values in fixed.items()}
+                self.count('closed_form_projections')
+
+        if projection is None:
+            capacities = self.get_daily_capacities(len(inputs['order']))
+            if self.randomise_daily_capacity == "True":
+                self.count('random_draws', len(capacities))
+            projection = projection_engine.project_days(inputs['daily_first_dose'], inputs['daily_second_dose'],
+                                                        inputs['is_actual'], inputs['cutoff_pos'], inputs['order'],
+                                                        capacities, day_scale)
+        self.count('days_projected', int((~inputs['is_actual']).sum()))
+        self.count('overflow_backfill_steps', int(projection['backfill_steps']))
+
+        for col in ['daily_first_dose', 'daily_second_dose', 'due_by_today', 'sd_overflow']:
+            self.projected_df[col] = projection[col]
+        for col in ['cumu_first_dose', 'cumu_second_dose']:
+            self.projected_df[col] = inputs[col]
+        for col in ['processed', 'day_filled']:
+            self.projected_df[col] = projection[col]
+        self.projected_df['falling_due_allocated'] = pd.arrays.BooleanArray(projection['falling_due_allocated'],
+                                                                            inputs['is_actual'])
+        if day_scale is not None:
+            self.projected_df['daily_capacity'] = self.daily_capacity
 
     def complete_projection_df(self):
         """takes the project_data output and then augments with cumsum, updated all vaccine output and backlog"""
-        manual_cumsum = self.projected_df[self.projected_df['cumu_first_dose'] == 0]
-        for i in manual_cumsum.index:
-            prev = i - 1
-            self.projected_df.loc[i, 'cumu_first_dose'] = self.projected_df.loc[i, 'daily_first_dose'] + self.projected_df.loc[prev, 'cumu_first_dose']
-            self.projected_df.loc[i, 'cumu_second_dose'] = self.projected_df.loc[i, 'daily_second_dose'] + self.projected_df.loc[prev, 'cumu_second_dose']
+        self.projected_df['cumu_first_dose'] = projection_engine.fill_cumulative(self.projected_df['daily_first_dose'].values,
+                                                                                 self.projected_df['cumu_first_dose'].values)
+        self.projected_df['cumu_second_dose'] = projection_engine.fill_cumulative(self.projected_df['daily_second_dose'].values,
+                                                                                  self.projected_df['cumu_second_dose'].values)
 
         self.projected_df['daily_all_vac'] = self.projected_df['daily_first_dose'] + self.projected_df['daily_second_dose']
         self.projected_df['vac_backlog'] = self.projected_df['cumu_first_dose'] - self.projected_df['cumu_second_dose']
 
     def est_target_hit_date(self):
-        """get estimated target hit date based on projections"""
-        target_hit = False
-        for i in self.projected_df.index:
-            if self.projected_df.loc[i, 'cumu_first_dose'] >= self.actual_data.target_val:
-                self.date_hit = f"The government will hit its target on {self.projected_df.loc[i, 'date'].date()}"
-                target_hit = True
-                break
-        if not target_hit:
+        """get estimated target hit date based on projections. worked out from projected_df each time (a binary search),
+        so it follows any later update to the projection"""
+        hit_pos = projection_engine.hit_positions(self.projected_df['cumu_first_dose'].values, self.actual_data.target_val)
+        if hit_pos >= 0:
+            self.date_hit = f"The government will hit its target on {self.projected_df['date'].iloc[hit_pos].date()}"
+        else:
             amount_vaccinated = int(self.projected_df['cumu_first_dose'].max())
             self.date_hit = f"Doesnt look like we're hitting any targets. At this rate we'll get to {amount_vaccinated} vaccinated, with " \
                             f"{self.actual_data.target_val - amount_vaccinated} left"
 
+    def scenario_key(self):
+        """canonical key for the scenario (data version, window, randomise flag, std dev, seed, dose interval). None
+        when the result can't be reused, i.e. randomised without a seed"""
+        if self.randomise_daily_capacity == "True":
+            if self.seed is None:
+                return None
+            return (self.actual_data.data_version(), self.run_rate_window, "True", float(self.randomise_std_dev), self.seed,
+                    str(self.dose_interval), self.capacity_model_key())
+        return (self.actual_data.data_version(), self.run_rate_window, "False", None, None, str(self.dose_interval),
+                self.capacity_model_key())
+
+    def capacity_model_key(self):
+        return self.capacity_model.key() if self.capacity_model is not None else None
+
     def collate_and_project_data(self):
-        self.get_capacity()
-        self.create_empty_projected_df()
-        self.project_data()
-        self.complete_projection_df()
+        key = self.scenario_key() if self.cache is not None else None
+        entry = self.cache.get(key) if key is not None else None
+        if entry is not None:
+            self.capacity = entry['capacity']
+            self.projected_df = entry['projected_df'].copy()
+            self.count('cache_hits')
+            return
+
+        with self.stage('get_capacity'):
+            self.get_capacity()
+        with self.stage('create_empty_projected_df'):
+            self.create_empty_projected_df()
+        with self.stage('project_data'):
+            self.project_data()
+        with self.stage('complete_projection_df'):
+            self.complete_projection_df()
+
+        if key is not None:
+            self.cache.put(key, {'capacity': self.capacity, 'projected_df': self.projected_df.copy()})
+
+    def run_ensemble(self, n_runs=1000, seed=None, percentiles=(5, 50, 95), chunk_size=250, n_workers=1):
+        """run n_runs seeded realisations of the randomised capacity projection (std dev from std_dev, whether or not
+        randomise_daily_capacity is set). realisations are split into chunks of chunk_size, each chunk is vectorised
+        and gets its own child seed, so results only depend on seed and chunk_size, not on n_workers. n_workers > 1
+        spreads chunks across a process pool, with the engine inputs published once to shared_arrays rather than
+        pickled into every chunk.
+
+        realisations whose second dose overflow runs out of horizon aren't valid projections; they're left out and
+        counted in ensemble_failed_runs, like failed_runs in scenario_sweep.
+
+        Sets ensemble_df (date plus a column per metric and percentile over the valid realisations, e.g.
+        cumu_first_dose_p50, NaN if none are valid), ensemble_hit_dates (target hit date per valid realisation, NaT
+        where the target is not hit) and ensemble_failed_runs. Returns ensemble_df"""
+        if 'status' not in self.projected_df.columns:
+            self.get_capacity()
+            self.create_empty_projected_df()
+        inputs = self.projection_inputs()
+        day_scale = self.capacity_day_scale(inputs)
+
+        chunk_runs = [min(chunk_size, n_runs - start) for start in range(0, n_runs, chunk_size)]
+        seeds = np.random.SeedSequence(seed).spawn(len(chunk_runs))
+        tasks = [(self.capacity, self.randomise_std_dev, runs, chunk_seed) for runs, chunk_seed in zip(chunk_runs, seeds)]
+
+        with self.stage('run_ensemble'):
+            if n_workers > 1:
+                with shared_arrays(dict(inputs, day_scale=day_scale)) as shared, \
+                        ProcessPoolExecutor(max_workers=n_workers) as executor:
+                    results = list(executor.map(projection_engine.run_shared_ensemble_chunk,
+                                                *zip(*[(shared.path,) + task for task in tasks])))
+            else:
+                results = [projection_engine.run_ensemble_chunk(inputs, *task, day_scale) for task in tasks]
+        self.count('random_draws', n_runs * len(inputs['order']))
+
+        valid = ~np.concatenate([result[2] for result in results])
+        self.ensemble_failed_runs = int((~valid).sum())
+        self.count('failed_runs', self.ensemble_failed_runs)
+        daily = {'daily_first_dose': np.concatenate([result[0] for result in results])[valid],
+                 'daily_second_dose': np.concatenate([result[1] for result in results])[valid]}
+        daily['cumu_first_dose'] = projection_engine.fill_cumulative(daily['daily_first_dose'], inputs['cumu_first_dose'])
+        daily['cumu_second_dose'] = projection_engine.fill_cumulative(daily['daily_second_dose'], inputs['cumu_second_dose'])
+
+        ensemble_df = pd.DataFrame({'date': inputs['dates']})
+        for metric, values in daily.items():
+            if valid.any():
+                bands = np.percentile(values, percentiles, axis=0)
+            else:
+                bands = np.full((len(percentiles), len(inputs['dates'])), np.nan)
+            for q, band in zip(percentiles, bands):
+                ensemble_df[f'{metric}_p{q}'] = band
+
+        hit_pos = projection_engine.first_crossing(daily['cumu_first_dose'], self.actual_data.target_val)
+        hit_dates = pd.Series(pd.to_datetime(inputs['dates'][np.maximum(hit_pos, 0)]), name='target_hit_date')
+        hit_dates[hit_pos < 0] = pd.NaT
+
+        self.ensemble_df = ensemble_df
+        self.ensemble_hit_dates = hit_dates
+        return ensemble_df
+
+    def period_totals(self, freq='D'):
+        """roll the projection up to calendar periods, 'D' daily, 'W' weekly or 'M' monthly, in one groupby. dose
+        columns are summed over the period, cumulative columns and backlog are taken at the period end. capacity is
+        the run rate times the calendar days in the period, so partial months at either end still get the full month
+        (with a capacity_model, the period's average daily capacity times its days). shared by all the plot builders"""
+        periods = self.projected_df['date'].dt.to_period(freq)
+        grouped = self.projected_df.groupby(periods, sort=True)
+        totals = grouped[['daily_first_dose', 'daily_second_dose', 'daily_all_vac']].sum()
+        totals = totals.join(grouped[['cumu_first_dose', 'cumu_second_dose', 'vac_backlog']].last())
+
+        totals['days'] = (totals.index.end_time.normalize() - totals.index.start_time).days + 1
+        if 'daily_capacity' in self.projected_df.columns:
+            totals['capacity'] = grouped['daily_capacity'].mean() * totals['days']
+        else:
+            totals['capacity'] = self.capacity * totals['days']
+        totals.insert(0, 'date', totals.index.start_time)
+        totals['rows'] = grouped.size()
+        return totals.reset_index(drop=True)
+
+    def plot_totals(self):
+        """daily totals for the bar charts, rolled up to weeks when there are more than max_plot_points days so the
+        payload sent to the browser stays bounded. weekly dose columns are averages per day so the daily scale holds"""
+        totals = self.period_totals()
+        if len(totals) <= self.max_plot_points:
+            return totals
+        weekly = self.period_totals('W')
+        for col in ['daily_first_dose', 'daily_second_dose', 'daily_all_vac']:
+            weekly[col] = weekly[col] / weekly['rows']
+        weekly['capacity'] = weekly['capacity'] / weekly['days']
+        return weekly
+
+    def line_trace(self, n_points):
+        """Scatter, or its webgl version for long series"""
+        import plotly.graph_objects as go
+        return go.Scattergl if n_points > self.max_plot_points else go.Scatter
 
     def daily_doses_projection_plot(self):
+        import plotly.graph_objects as go
 
+        totals = self.plot_totals()
         fig = go.Figure(data=[
-            go.Bar(name='First Dose', x=self.projected_df['date'], y=self.projected_df['daily_first_dose'], marker_color='royalblue'),
-            go.Bar(name='Second Dose', x=self.projected_df['date'], y=self.projected_df['daily_second_dose'], marker_color='firebrick')
+            go.Bar(name='First Dose', x=totals['date'], y=totals['daily_first_dose'], marker_color='royalblue'),
+            go.Bar(name='Second Dose', x=totals['date'], y=totals['daily_second_dose'], marker_color='firebrick')
         ])
 
-        fig.add_shape(type="line",
-            xref="x", yref="y",
-            x0=self.projected_df['date'].min(), y0=self.capacity, x1=self.projected_df['date'].max(), y1=self.capacity,
-            line=dict(
-                color="black",
-                width=3,
-            ))
+        if 'daily_capacity' in self.projected_df.columns:
+            fig.add_trace(go.Scatter(name='Daily Capacity', x=totals['date'], y=totals['capacity'], mode='lines',
+                                     line=dict(color="black", width=3)))
+        else:
+            fig.add_shape(type="line",
+                xref="x", yref="y",
+                x0=totals['date'].min(), y0=self.capacity, x1=totals['date'].max(), y1=self.capacity,
+                line=dict(
+                    color="black",
+                    width=3,
+                ))
 
         fig.add_trace(go.Scatter(
             name='Average Daily Capacity',
-            x=[self.projected_df['date'][len(self.projected_df['date'])//2]],
+            x=[totals['date'][len(totals)//2]],
             y=[self.capacity + (self.capacity*.4)],
             text="Average Daily Vaccines Administered - All Types",
             mode="text",
@@ -218,14 +425,17 @@ class projected_data():
 
 
     def cumulative_doses_plot(self):
+        import plotly.graph_objects as go
+
+        totals = self.plot_totals()
         fig = go.Figure(data=[
-            go.Bar(name='First Dose', x=self.projected_df['date'], y=self.projected_df['cumu_first_dose'], marker_color='royalblue'),
-            go.Bar(name='Second Dose', x=self.projected_df['date'], y=self.projected_df['cumu_second_dose'], marker_color='firebrick')
+            go.Bar(name='First Dose', x=totals['date'], y=totals['cumu_first_dose'], marker_color='royalblue'),
+            go.Bar(name='Second Dose', x=totals['date'], y=totals['cumu_second_dose'], marker_color='firebrick')
         ])
 
         fig.add_shape(type="line",
                       xref="x", yref="y",
-                      x0=self.projected_df['date'].min(), y0=self.actual_data.target_val, x1=self.projected_df['date'].max(), y1=self.actual_data.target_val,
+                      x0=totals['date'].min(), y0=self.actual_data.target_val, x1=totals['date'].max(), y1=self.actual_data.target_val,
                       line=dict(
                           color="black",
                           width=3,
@@ -233,7 +443,7 @@ class projected_data():
 
         fig.add_trace(go.Scatter(
             name='Govt Target',
-            x=[self.projected_df['date'][len(self.projected_df['date']) // 2]],
+            x=[totals['date'][len(totals) // 2]],
             y=[self.actual_data.target_val + (self.actual_data.target_val * .3)],
             text="All Adults In UK - Gov't Target",
             mode="text",
@@ -255,27 +465,13 @@ class projected_data():
 
 
     def second_doses_by_month_perc_plot(self):
+        import plotly.graph_objects as go
 
-        second_dose_by_month = {1: 0, 2: 0, 3: 0, 4: 0, 5: 0, 6: 0, 7: 0}
-        for i in self.projected_df.index:
-            month_val = self.projected_df.loc[i, 'date'].month
-            second_dose_by_month[month_val] += self.projected_df.loc[i, 'daily_second_dose']
-
-        month_list = list(second_dose_by_month.values())
-        months = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul']
-        days_in_month= {'Jan':31,
-                       'Feb':28,
-                        'Mar':31,
-                        'Apr':30,
-                        'May':31,
-                        'Jun':30,
-                        'Jul':31}
-
-        monthly_vax_cap = []
-
-        for i in range(len(months)):
-            cap = self.capacity * days_in_month[months[i]]
-            monthly_vax_cap.append(cap - month_list[i])
+        monthly = self.period_totals('M')
+        multi_year = monthly['date'].dt.year.nunique() > 1
+        months = list(monthly['date'].dt.strftime('%b %Y' if multi_year else '%b'))
+        month_list = monthly['daily_second_dose']
+        monthly_vax_cap = monthly['capacity'] - monthly['daily_second_dose']
 
         # plot as bar
         fig = go.Figure(data=[
@@ -298,12 +494,16 @@ class projected_data():
 
 
     def second_dose_backlog_daily_plot(self):
-        fig = go.Figure([go.Scatter(x=self.projected_df['date'], y=self.projected_df['vac_backlog'],
-                                    line=dict(color='LightSeaGreen', width=4)),
-                         go.Scatter(x=self.projected_df['date'], y=self.projected_df['daily_first_dose'],
-                                    line=dict(color='royalblue', width=4)),
-                         go.Scatter(x=self.projected_df['date'], y=self.projected_df['daily_second_dose'],
-                                    line=dict(color='firebrick', width=4))]
+        import plotly.graph_objects as go
+
+        totals = self.period_totals()
+        scatter = self.line_trace(len(totals))
+        fig = go.Figure([scatter(x=totals['date'], y=totals['vac_backlog'],
+                                 line=dict(color='LightSeaGreen', width=4)),
+                         scatter(x=totals['date'], y=totals['daily_first_dose'],
+                                 line=dict(color='royalblue', width=4)),
+                         scatter(x=totals['date'], y=totals['daily_second_dose'],
+                                 line=dict(color='firebrick', width=4))]
                         )
 
         fig.update_layout(title_text="Second Dose Backlog",
@@ -322,17 +522,21 @@ class projected_data():
 
 
     def second_dose_backlog_cumu_plot(self):
-        fig = go.Figure([go.Scatter(name='2nd Doses Outstanding', x=self.projected_df['date'], y=self.projected_df['vac_backlog'],
-                                    line=dict(color='LightSeaGreen', width=4)),
-                         go.Scatter(name='Cumulative 1st Doses', x=self.projected_df['date'], y=self.projected_df['cumu_first_dose'],
-                                    line=dict(color='royalblue', width=4)),
-                         go.Scatter(name='Cumulative 2nd Doses', x=self.projected_df['date'], y=self.projected_df['cumu_second_dose'],
-                                    line=dict(color='firebrick', width=4))]
+        import plotly.graph_objects as go
+
+        totals = self.period_totals()
+        scatter = self.line_trace(len(totals))
+        fig = go.Figure([scatter(name='2nd Doses Outstanding', x=totals['date'], y=totals['vac_backlog'],
+                                 line=dict(color='LightSeaGreen', width=4)),
+                         scatter(name='Cumulative 1st Doses', x=totals['date'], y=totals['cumu_first_dose'],
+                                 line=dict(color='royalblue', width=4)),
+                         scatter(name='Cumulative 2nd Doses', x=totals['date'], y=totals['cumu_second_dose'],
+                                 line=dict(color='firebrick', width=4))]
                         )
 
         fig.add_shape(type="line",
                       xref="x", yref="y",
-                      x0=self.projected_df['date'].min(), y0=self.actual_data.target_val, x1=self.projected_df['date'].max(), y1=self.actual_data.target_val,
+                      x0=totals['date'].min(), y0=self.actual_data.target_val, x1=totals['date'].max(), y1=self.actual_data.target_val,
                       line=dict(
                           color="black",
                           width=3,
@@ -340,7 +544,7 @@ class projected_data():
 
         fig.add_trace(go.Scatter(
             name='Govt Target',
-            x=[self.projected_df['date'][len(self.projected_df['date']) // 2]],
+            x=[totals['date'][len(totals) // 2]],
             y=[self.actual_data.target_val + (self.actual_data.target_val * .1)],
             text="All Adults In UK - Gov't Target",
             mode="text",
@@ -361,10 +565,11 @@ class projected_data():
         return fig
 
 
-fd_fname = 'first_dose_data_220321.csv'
-sd_fname = 'second_dose_data_220321.csv'
-actual_vaccine_data = current_vaccine_data(fd_fname, sd_fname)
-test = projected_data(actual_vaccine_data)
-test.collate_and_project_data()
-#test.projected_df.to_csv('projected_test.csv')
-test.second_dose_backlog_cumu_plot()
\ No newline at end of file
+if __name__ == '__main__':
+    fd_fname = 'first_dose_data_220321.csv'
+    sd_fname = 'second_dose_data_220321.csv'
+    actual_vaccine_data = current_vaccine_data(fd_fname, sd_fname)
+    test = projected_data(actual_vaccine_data)
+    test.collate_and_project_data()
+    #test.projected_df.to_csv('projected_test.csv')
+    test.second_dose_backlog_cumu_plot()
@@ -0,0 +1,354 @@
+import numpy as np
+
+from shared_arrays import attach_arrays
+
+
+def visit_order(dates, filter_dates):
+    """take the sorted row dates and the month filter dates, return the row positions in the order the projection
+    walks them. each 2 month window [filter i, filter i+2) is walked in turn, so most rows are visited twice"""
+    dates = np.asarray(dates, dtype='datetime64[ns]')
+    filter_dates = np.asarray(filter_dates, dtype='datetime64[ns]')
+    bounds = np.searchsorted(dates, filter_dates, side='left')
+    windows = [np.arange(bounds[i], bounds[i + 2]) for i in range(len(bounds) - 2)]
+    if not windows:
+        return np.empty(0, dtype=np.int64)
+    return np.concatenate(windows).astype(np.int64)
+
+
+def cutoff_positions(dates, cutoffs):
+    """map each row's second vac cutoff date onto a row position (day offset). -1 where the cutoff falls outside
+    the projection horizon"""
+    dates = np.asarray(dates, dtype='datetime64[D]')
+    cutoffs = np.asarray(cutoffs, dtype='datetime64[D]')
+    offsets = (cutoffs - dates[0]).astype(np.int64)
+    return np.where((offsets >= 0) & (offsets < len(dates)), offsets, -1)
+
+
+def check_daily_index(dates):
+    """the engine indexes rows by day offset, so dates need to be one row per day with no gaps"""
+    dates = np.asarray(dates, dtype='datetime64[D]')
+    if len(dates) and np.any(np.diff(dates).astype(np.int64) != 1):
+        raise ValueError("projection dates must be consecutive days with one row per day")
+
+
+class free_slot_index():
+    """union-find "next free slot" index over day slots, for one or many realisations. find gives the latest day at or
+    before a given day that is still open (-1 if there is none), skipping runs of closed days in amortised near
+    constant time. closing a day links it to the day before. one index per shared capacity pool, so dose types
+    drawing on the same daily capacity share an index"""
+
+    def __init__(self, is_closed):
+        is_closed = np.atleast_2d(np.asarray(is_closed, dtype=bool))
+        n_runs, n = is_closed.shape
+        # slot i is stored at i + 1, position 0 is an always open sentinel meaning "no open day"
+        slots = np.arange(n + 1)
+        self.parent = np.tile(slots, (n_runs, 1))
+        self.parent[:, 1:] -= is_closed
+
+    def find(self, day, run=0):
+        parent = self.parent[run]
+        x = day + 1
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x - 1
+
+    def close(self, day, run=0):
+        self.parent[run, day + 1] = day
+
+    def find_many(self, days, runs):
+        """find for a set of (run, day) pairs at once"""
+        x = np.asarray(days) + 1
+        while True:
+            p = self.parent[runs, x]
+            todo = p != x
+            if not todo.any():
+                return x - 1
+            grand = self.parent[runs[todo], p[todo]]
+            self.parent[runs[todo], x[todo]] = grand
+            x[todo] = grand
+
+    def close_many(self, days, runs):
+        self.parent[runs, np.asarray(days) + 1] = days
+
+
+def project_days(daily_first_dose, daily_second_dose, is_actual, cutoff_pos, order, capacities, day_scale=None):
+    """run the projection over day-offset indexed arrays.
+
+    For each visited row: fill spare capacity with first doses, schedule those first doses as due on the cutoff day
+    and allocate the second doses due on the cutoff day, back-filling any overflow into the nearest earlier days with
+    space. the nearest earlier days with space are found through a free_slot_index over day_filled, so a big overflow
+    never rescans full days. capacities holds the (possibly randomised) daily capacity for each visit in order.
+    day_scale optionally scales capacity per day (growth, seasonality): a visit's capacity on day d is
+    capacities[visit] * day_scale[d], for the day filled, the cutoff day and each back-filled day alike.
+
+    Returns a dict of arrays: daily_first_dose, daily_second_dose, due_by_today, sd_overflow, processed, day_filled
+    and falling_due_allocated, plus backfill_steps, the number of earlier days overflow was back-filled into."""
+    n = len(daily_first_dose)
+    first = np.array(daily_first_dose, dtype=np.float64)
+    second = np.array(daily_second_dose, dtype=np.float64)
+    is_actual = np.asarray(is_actual, dtype=bool)
+    cutoff_pos = np.asarray(cutoff_pos, dtype=np.int64)
+    due = np.zeros(n, dtype=np.float64)
+    sd_overflow = np.zeros(n, dtype=np.float64)
+    processed = np.zeros(n, dtype=bool)
+    day_filled = is_actual.copy()
+    falling_due_allocated = np.zeros(n, dtype=bool)
+    open_days = free_slot_index(day_filled)
+    day_scale = np.ones(n) if day_scale is None else np.asarray(day_scale, dtype=np.float64)
+    backfill_steps = 0
+    last = n - 1
+
+    for j, visit_capacity in zip(order, capacities):
+        capacity = visit_capacity * day_scale[j]
+        # fill remaining space with first doses
+        if not is_actual[j] and second[j] < capacity:
+            first[j] = capacity - second[j]
+            day_filled[j] = True
+            open_days.close(j)
+
+        # schedule first doses as second doses falling due
+        target = cutoff_pos[j]
+        if not processed[j]:
+            if target >= 0:
+                due[target] = first[j]
+            processed[j] = True
+
+        if target < 0 or target >= last:
+            continue
+
+        # allocate second doses falling due on the cutoff day
+        amount_due = due[target]
+        capacity = visit_capacity * day_scale[target]
+        if amount_due > capacity:
+            second[target] = capacity
+            day_filled[target] = True
+            open_days.close(target)
+            processed[target] = True
+            overflow = amount_due - capacity
+            day_before = target
+            while overflow > 0:
+                day_before = open_days.find(day_before - 1)
+                if day_before < 0:
+                    raise IndexError("second dose overflow could not be allocated within the projection horizon")
+                backfill_steps += 1
+                remaining_availability = visit_capacity * day_scale[day_before] - second[day_before]
+                if remaining_availability < overflow:
+                    filled = remaining_availability
+                    day_filled[day_before] = True
+                    open_days.close(day_before)
+                    processed[day_before] = True
+                else:
+                    filled = overflow
+                overflow -= filled
+                second[day_before] += filled
+                sd_overflow[day_before] += filled
+        else:
+            second[target] = amount_due
+        falling_due_allocated[target] = True
+
+    return {'daily_first_dose': first,
+            'daily_second_dose': second,
+            'due_by_today': due,
+            'sd_overflow': sd_overflow,
+            'processed': processed,
+            'day_filled': day_filled,
+            'falling_due_allocated': falling_due_allocated,
+            'backfill_steps': backfill_steps}
+
+
+def project_days_batch(daily_first_dose, daily_second_dose, is_actual, cutoff_pos, order, capacities, day_scale=None,
+                       raise_exhausted=True):
+    """project_days across many realisations at once. capacities is a (realisations, visits) matrix, day_scale if
+    given is (days,) or (realisations, days), and every returned array is (realisations, days). each visit is applied
+    to all realisations with array operations; overflow back-filling steps all realisations with outstanding overflow
+    to their next open earlier day together. with raise_exhausted off, a realisation whose overflow runs out of
+    horizon is flagged in 'exhausted' (its results are not valid) rather than failing the whole batch"""
+    capacities = np.atleast_2d(np.asarray(capacities, dtype=np.float64))
+    n_runs = capacities.shape[0]
+    n = len(daily_first_dose)
+    first = np.tile(np.asarray(daily_first_dose, dtype=np.float64), (n_runs, 1))
+    second = np.tile(np.asarray(daily_second_dose, dtype=np.float64), (n_runs, 1))
+    is_actual = np.asarray(is_actual, dtype=bool)
+    cutoff_pos = np.asarray(cutoff_pos, dtype=np.int64)
+    due = np.zeros((n_runs, n), dtype=np.float64)
+    sd_overflow = np.zeros((n_runs, n), dtype=np.float64)
+    processed = np.zeros((n_runs, n), dtype=bool)
+    day_filled = np.tile(is_actual, (n_runs, 1))
+    falling_due_allocated = np.zeros((n_runs, n), dtype=bool)
+    open_days = free_slot_index(day_filled)
+    exhausted = np.zeros(n_runs, dtype=bool)
+    backfill_steps = np.zeros(n_runs, dtype=np.int64)
+    runs = np.arange(n_runs)
+    day_scale = np.ones((n_runs, n)) if day_scale is None else np.broadcast_to(day_scale, (n_runs, n))
+    last = n - 1
+
+    for visit, j in enumerate(order):
+        visit_capacity = capacities[:, visit]
+        capacity = visit_capacity * day_scale[:, j]
+        if not is_actual[j]:
+            fill = second[:, j] < capacity
+            first[fill, j] = capacity[fill] - second[fill, j]
+            day_filled[fill, j] = True
+            open_days.close_many(np.full(fill.sum(), j), runs[fill])
+
+        target = cutoff_pos[j]
+        unprocessed = ~processed[:, j]
+        if target >= 0:
+            due[unprocessed, target] = first[unprocessed, j]
+        processed[:, j] = True
+
+        if target < 0 or target >= last:
+            continue
+
+        amount_due = due[:, target]
+        capacity = visit_capacity * day_scale[:, target]
+        over = amount_due > capacity
+        second[:, target] = np.where(over, capacity, amount_due)
+        day_filled[over, target] = True
+        open_days.close_many(np.full(over.sum(), target), runs[over])
+        processed[over, target] = True
+        falling_due_allocated[:, target] = True
+
+        overflow = np.where(over, amount_due - capacity, 0.0)
+        day_before = np.full(n_runs, target)
+        active = runs[overflow > 0]
+        while len(active):
+            day_before[active] = open_days.find_many(day_before[active] - 1, active)
+            if np.any(day_before[active] < 0):
+                if raise_exhausted:
+                    raise IndexError("second dose overflow could not be allocated within the projection horizon")
+                exhausted[active[day_before[active] < 0]] = True
+                active = active[day_before[active] >= 0]
+            r, d = active, day_before[active]
+            backfill_steps[r] += 1
+            remaining_availability = visit_capacity[r] * day_scale[r, d] - second[r, d]
+            partial = remaining_availability < overflow[r]
+            filled = np.where(partial, remaining_availability, overflow[r])
+            day_filled[r[partial], d[partial]] = True
+            open_days.close_many(d[partial], r[partial])
+            processed[r[partial], d[partial]] = True
+            overflow[r] -= filled
+            second[r, d] += filled
+            sd_overflow[r, d] += filled
+            active = active[overflow[active] > 0]
+
+    return {'daily_first_dose': first,
+            'daily_second_dose': second,
+            'due_by_today': due,
+            'sd_overflow': sd_overflow,
+            'processed': processed,
+            'day_filled': day_filled,
+            'falling_due_allocated': falling_due_allocated,
+            'exhausted': exhausted,
+            'backfill_steps': backfill_steps}
+
+
+def project_days_fixed(daily_first_dose, daily_second_dose, is_actual, cutoff_pos, order, capacities, day_scale=None):
+    """closed form of project_days for a capacity that is the same every day, for one or many capacities at once.
+
+    Without overflow each row's second doses are just the first doses of the latest row whose cutoff lands on it, and
+    its first doses fill whatever capacity is left. a cutoff is always at least lag days (the shortest dosing interval)
+    ahead, so the rows are worked through lag days at a time with shifted array operations instead of visit by visit.
+    capacities is a scalar or one capacity per realisation, day_scale (days,) or (realisations, days) as in
+    project_days_batch; returned arrays are (realisations, days) like
+    project_days_batch, plus 'overflowed', True for realisations where some second doses falling due exceed capacity.
+    those results are not valid and need project_days, which back-fills the overflow"""
+    capacities = np.atleast_1d(np.asarray(capacities, dtype=np.float64))
+    n_runs = len(capacities)
+    n = len(daily_first_dose)
+    first = np.tile(np.asarray(daily_first_dose, dtype=np.float64), (n_runs, 1))
+    second = np.tile(np.asarray(daily_second_dose, dtype=np.float64), (n_runs, 1))
+    is_actual = np.asarray(is_actual, dtype=bool)
+    cutoff_pos = np.asarray(cutoff_pos, dtype=np.int64)
+    due = np.zeros((n_runs, n), dtype=np.float64)
+    day_filled = np.tile(is_actual, (n_runs, 1))
+    falling_due_allocated = np.zeros((n_runs, n), dtype=bool)
+    overflowed = np.zeros(n_runs, dtype=bool)
+    capacity = capacities[:, None] * (1.0 if day_scale is None else np.broadcast_to(day_scale, (n_runs, n)))
+    capacity = np.broadcast_to(capacity, (n_runs, n))
+    last = n - 1
+
+    visited = np.zeros(n, dtype=bool)
+    visited[np.asarray(order, dtype=np.int64)] = True
+    sources = np.flatnonzero(visited & (cutoff_pos >= 0))
+    # rows sharing a cutoff day overwrite each other's dues, the latest one is what's left due
+    latest = np.zeros(n, dtype=bool)
+    if len(sources):
+        latest[sources[np.append(cutoff_pos[sources[:-1]] != cutoff_pos[sources[1:]], True)]] = True
+    allocates = np.zeros(n, dtype=bool)
+    allocates[sources[cutoff_pos[sources] < last]] = True
+    falling_due_allocated[:, cutoff_pos[allocates]] = True
+    fills = visited & ~is_actual
+    lag = max(int((cutoff_pos[sources] - sources).min()), 1) if len(sources) else max(n, 1)
+
+    for start in range(0, n, lag):
+        block = slice(start, start + lag)
+        fill = fills[block] & (second[:, block] < capacity[:, block])
+        first[:, block] = np.where(fill, capacity[:, block] - second[:, block], first[:, block])
+        day_filled[:, block] |= fill
+
+        rows = start + np.flatnonzero(allocates[block])
+        overflowed |= (first[:, rows] > capacity[:, cutoff_pos[rows]]).any(axis=1)
+        rows = start + np.flatnonzero(latest[block])
+        due[:, cutoff_pos[rows]] = first[:, rows]
+        targets = cutoff_pos[rows][cutoff_pos[rows] < last]
+        second[:, targets] = due[:, targets]
+
+    return {'daily_first_dose': first,
+            'daily_second_dose': second,
+            'due_by_today': due,
+            'sd_overflow': np.zeros((n_runs, n), dtype=np.float64),
+            'processed': np.tile(visited, (n_runs, 1)),
+            'day_filled': day_filled,
+            'falling_due_allocated': falling_due_allocated,
+            'overflowed': overflowed,
+            'backfill_steps': np.zeros(n_runs, dtype=np.int64)}
+
+
+def fill_cumulative(daily, cumulative):
+    """cumulative totals for rows with no reported cumulative figure (0), carried on from the last reported row.
+    daily can be (days,) or (realisations, days); cumulative is the reported (days,) series"""
+    daily = np.asarray(daily, dtype=np.float64)
+    cumulative = np.asarray(cumulative, dtype=np.float64)
+    missing = cumulative == 0
+    running = np.where(missing, daily, 0).cumsum(axis=-1)
+    anchor = np.maximum.accumulate(np.where(missing, -1, np.arange(len(cumulative))))
+    anchor = np.maximum(anchor, 0)
+    return np.where(missing, cumulative[anchor] + running - running[..., anchor], cumulative)
+
+
+def first_crossing(cumulative, target_val):
+    """position of the first day a cumulative series reaches target_val, -1 if it never does. works along the last
+    axis so a (realisations, days) matrix gives one position per realisation"""
+    hit = np.asarray(cumulative) >= target_val
+    return np.where(hit.any(axis=-1), hit.argmax(axis=-1), -1)
+
+
+def hit_positions(cumulative, target_vals):
+    """first_crossing for many targets on one cumulative series by binary search. the running max crosses a target on
+    the same day the series first does and is sorted, so each target is a searchsorted. -1 where never reached"""
+    running_max = np.maximum.accumulate(np.asarray(cumulative, dtype=np.float64))
+    pos = np.searchsorted(running_max, target_vals, side='left')
+    return np.where(pos < len(running_max), pos, -1)
+
+
+def run_ensemble_chunk(inputs, capacity, std_dev, n_runs, seed, day_scale=None):
+    """run one seeded chunk of an ensemble. daily capacity noise for the whole chunk is drawn as one
+    (realisations, visits) matrix, day_scale as in project_days. returns daily first and second doses as
+    (realisations, days) arrays and the exhausted flag per realisation (overflow ran out of horizon, results not
+    valid)"""
+    rng = np.random.default_rng(seed)
+    noise = rng.normal(0, std_dev, (n_runs, len(inputs['order'])))
+    capacities = capacity + (noise * capacity)
+    projection = project_days_batch(inputs['daily_first_dose'], inputs['daily_second_dose'], inputs['is_actual'],
+                                    inputs['cutoff_pos'], inputs['order'], capacities, day_scale, raise_exhausted=False)
+    return projection['daily_first_dose'], projection['daily_second_dose'], projection['exhausted']
+
+
+def run_shared_ensemble_chunk(path, capacity, std_dev, n_runs, seed):
+    """run_ensemble_chunk with the inputs (and day_scale, if published) attached from shared_arrays at path rather
+    than pickled into each task"""
+    inputs = attach_arrays(path)
+    day_scale = inputs.pop('day_scale', None)
+    return run_ensemble_chunk(inputs, capacity, std_dev, n_runs, seed, day_scale)
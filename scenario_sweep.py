@@ -0,0 +1,127 @@
+"""Sensitivity sweeps: evaluate a grid of capacity multiplier x growth rate x dosing interval x std dev x target value
+in one go and return a tidy table with the target hit date and peak backlog for every grid point.
+
+    from scenario_sweep import sweep
+    results = sweep(actual_data, capacity_multipliers=[0.8, 1.0, 1.2], growth_rates=[0, 0.02],
+                    dose_intervals=[8, 10, 12], target_vals=[45000000, 53000000])
+
+Dosing intervals are given in weeks (None for the default 3 months). All grid points sharing a dosing interval are
+projected together as one batch of realisations; fixed capacity points take the closed form path and only points that
+overflow (or are randomised) go through the batched visit by visit engine.
+"""
+import itertools
+
+import numpy as np
+import pandas as pd
+
+from vaccination_data import DOSE_INTERVAL
+from projection_data import projected_data
+from capacity_models import capacity_model, exponential_growth
+import projection_engine
+
+
+def interval_offset(interval):
+    """None for the default interval, a number of weeks, or a DateOffset as is"""
+    if interval is None:
+        return DOSE_INTERVAL
+    if isinstance(interval, pd.DateOffset):
+        return interval
+    return pd.DateOffset(weeks=interval)
+
+
+def interval_label(offset):
+    return ', '.join(f'{value} {unit}' for unit, value in offset.kwds.items())
+
+
+def project_realisations(inputs, capacities, day_scale, fixed):
+    """daily first and second doses for every realisation, (realisations, days). rows flagged fixed have the same
+    capacity every visit and go through the closed form path first. rows whose overflow runs out of horizon are NaN"""
+    args = [inputs[col] for col in ['daily_first_dose', 'daily_second_dose', 'is_actual', 'cutoff_pos', 'order']]
+    n_rows = capacities.shape[0]
+    first = np.full((n_rows, len(inputs['dates'])), np.nan)
+    second = np.full((n_rows, len(inputs['dates'])), np.nan)
+
+    todo = np.flatnonzero(~fixed)
+    if fixed.any():
+        rows = np.flatnonzero(fixed)
+        projection = projection_engine.project_days_fixed(*args, capacities[rows, 0], day_scale[rows])
+        done = ~projection['overflowed']
+        first[rows[done]] = projection['daily_first_dose'][done]
+        second[rows[done]] = projection['daily_second_dose'][done]
+        todo = np.sort(np.concatenate([todo, rows[~done]]))
+
+    if len(todo):
+        projection = projection_engine.project_days_batch(*args, capacities[todo], day_scale[todo],
+                                                          raise_exhausted=False)
+        done = ~projection['exhausted']
+        first[todo[done]] = projection['daily_first_dose'][done]
+        second[todo[done]] = projection['daily_second_dose'][done]
+    return first, second
+
+
+def sweep(actual_data, capacity_multipliers=(1.0,), growth_rates=(0.0,), dose_intervals=(None,), target_vals=None,
+          std_devs=(0.0,), run_rate_window="weekly_avg", n_runs=1, seed=None):
+    """project every combination of the options and score each grid point.
+
+    capacity_multipliers scale the run rate capacity, growth_rates are weekly compound growth from the first projected
+    day, dose_intervals are weeks (None for the default), target_vals default to the actual_data target. std_devs
+    above 0 randomise daily capacity as in projected_data, with n_runs seeded realisations per grid point sharing the
+    same draws across grid points. target_hit_date is the median hit date over realisations (NaT if most never hit),
+    hit_probability the share that do, peak_backlog the median of the highest first less second doses backlog and
+    failed_runs the realisations whose overflow ran out of horizon.
+
+    Returns one row per grid point"""
+    target_vals = [actual_data.target_val] if target_vals is None else list(target_vals)
+    points = list(itertools.product(capacity_multipliers, growth_rates, std_devs))
+    multipliers, growths, stds = (np.repeat(np.array(values, dtype=np.float64), n_runs) for values in zip(*points))
+
+    results = []
+    for interval in dose_intervals:
+        offset = interval_offset(interval)
+        projection = projected_data(actual_data, run_rate_window=run_rate_window, randomise_daily_capacity="False",
+                                    cache=None, dose_interval=offset)
+        projection.get_capacity()
+        projection.create_empty_projected_df()
+        inputs = projection.projection_inputs()
+        n_days = len(inputs['dates'])
+        start_pos = int(np.argmin(inputs['is_actual'])) if not inputs['is_actual'].all() else n_days
+
+        noise = np.random.default_rng(seed).normal(0, 1, (n_runs, len(inputs['order'])))
+        noise = np.tile(noise, (len(points), 1))
+        capacities = (projection.capacity * multipliers)[:, None] * (1 + stds[:, None] * noise)
+        # growth as a capacity model on a base of 1, so it's the per day scale on the run rate
+        day_scale = np.array([capacity_model(exponential_growth(growth)).daily_capacity(1.0, inputs['dates'], start_pos)
+                              for growth in np.unique(growths)])
+        day_scale = day_scale[np.searchsorted(np.unique(growths), growths)]
+
+        first, second = project_realisations(inputs, capacities, day_scale, stds == 0)
+        cumu_first = projection_engine.fill_cumulative(first, inputs['cumu_first_dose'])
+        cumu_second = projection_engine.fill_cumulative(second, inputs['cumu_second_dose'])
+        failed = np.isnan(cumu_first).any(axis=1)
+        peak_backlog = np.where(failed, np.nan, np.maximum.reduce(cumu_first - cumu_second, axis=1, initial=-np.inf))
+
+        hit_pos = np.full((len(multipliers), len(target_vals)), -1)
+        for row in np.flatnonzero(~failed):
+            hit_pos[row] = projection_engine.hit_positions(cumu_first[row], target_vals)
+
+        for i, (multiplier, growth, std_dev) in enumerate(points):
+            runs = slice(i * n_runs, (i + 1) * n_runs)
+            ok = ~failed[runs]
+            for k, target_val in enumerate(target_vals):
+                pos = hit_pos[runs, k][ok]
+                ranked = np.sort(np.where(pos >= 0, pos, n_days))
+                median_pos = ranked[(len(ranked) - 1) // 2] if len(ranked) else n_days
+                results.append({'dose_interval': interval_label(offset),
+                                'capacity_multiplier': multiplier,
+                                'growth_rate': growth,
+                                'std_dev': std_dev,
+                                'target_val': target_val,
+                                'capacity': projection.capacity * multiplier,
+                                'target_hit_date': inputs['dates'][median_pos] if median_pos < n_days else pd.NaT,
+                                'hit_probability': float((pos >= 0).mean()) if len(pos) else np.nan,
+                                'peak_backlog': float(np.median(peak_backlog[runs][ok])) if ok.any() else np.nan,
+                                'failed_runs': int((~ok).sum())})
+
+    results = pd.DataFrame(results)
+    results['target_hit_date'] = pd.to_datetime(results['target_hit_date'])
+    return results
@@ -0,0 +1,56 @@
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+
+def column_values(values):
+    """a df column as an array np.save can write without pickling: object/category columns become fixed width
+    unicode"""
+    if values.dtype == object or isinstance(values.dtype, pd.CategoricalDtype):
+        return values.astype(str).values.astype(str)
+    return values.values
+
+
+class shared_arrays():
+    """named arrays published once for a process pool. each is written to a .npy in a temp dir and workers attach with
+    attach_arrays(path), which memory maps them read only: the pages are shared through the os page cache, so arrays
+    used as they are (e.g. the engine inputs) aren't copied per worker. only path is sent to each task. use as a
+    context manager (or call close) to remove the files"""
+
+    def __init__(self, arrays, dir=None):
+        self.path = tempfile.mkdtemp(prefix='vac-shared-', dir=dir)
+        names = [name for name, values in arrays.items() if values is not None]
+        for i, name in enumerate(names):
+            np.save(os.path.join(self.path, f'{i}.npy'), np.asarray(arrays[name]))
+        with open(os.path.join(self.path, 'names.json'), 'w') as f:
+            json.dump(names, f)
+
+    @classmethod
+    def from_frame(cls, df, dir=None):
+        return cls({col: column_values(df[col]) for col in df.columns}, dir=dir)
+
+    def close(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def attach_arrays(path):
+    """dict of the read only memory mapped arrays published by shared_arrays"""
+    with open(os.path.join(path, 'names.json')) as f:
+        names = json.load(f)
+    return {name: np.load(os.path.join(path, f'{i}.npy'), mmap_mode='r') for i, name in enumerate(names)}
+
+
+def attach_frame(path, start=0, stop=None):
+    """rows start:stop of a df published with shared_arrays.from_frame. only those rows are read from the mapped files,
+    and pandas copies them into the df, so each task holds just its own slice rather than the whole feed"""
+    return pd.DataFrame({name: values[start:stop] for name, values in attach_arrays(path).items()})
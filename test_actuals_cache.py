@@ -0,0 +1,47 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import actuals_cache
+from vaccination_data import current_vaccine_data
+from projection_data import projected_data
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+FD_FNAME = os.path.join(HERE, 'first_dose_data_220321.csv')
+SD_FNAME = os.path.join(HERE, 'second_dose_data_220321.csv')
+RUN_RATES = ['daily_avg_week', 'daily_avg_1month', 'daily_avg_3month']
+
+
+def date_hit(actual_data):
+    projection = projected_data(actual_data, randomise_daily_capacity="False", cache=None)
+    projection.collate_and_project_data()
+    projection.est_target_hit_date()
+    return projection.date_hit
+
+
+@pytest.mark.parametrize('target_val', [53000000, 30000000])
+def test_cached_entry_matches_fresh_build(tmp_path, target_val):
+    built = actuals_cache.load_actual_data(FD_FNAME, SD_FNAME, target_val, cache_dir=str(tmp_path))
+    assert len(os.listdir(tmp_path)) == 1
+    cached = actuals_cache.load_actual_data(FD_FNAME, SD_FNAME, target_val, cache_dir=str(tmp_path))
+    fresh = current_vaccine_data(FD_FNAME, SD_FNAME, target_val)
+
+    for actual_data in [built, cached]:
+        # category columns come back from the .npy files as strings
+        pd.testing.assert_frame_equal(actual_data.vac_df.astype({'areaName': str}),
+                                      fresh.vac_df.astype({'areaName': str}))
+        assert actual_data.today == fresh.today
+        for name in RUN_RATES:
+            assert np.array_equal(getattr(actual_data, name), getattr(fresh, name), equal_nan=True), name
+        assert np.array_equal(actual_data.unadjusted_first_row, fresh.unadjusted_first_row, equal_nan=True)
+        assert np.array_equal(actual_data.run_rate_index.sums, fresh.run_rate_index.sums)
+        pd.testing.assert_frame_equal(actual_data.waffle_df, fresh.waffle_df)
+        assert date_hit(actual_data) == date_hit(fresh)
+
+
+def test_key_changes_with_version(monkeypatch):
+    key = actuals_cache.cache_key(FD_FNAME, SD_FNAME, 53000000, '31/07/2021', '31/08/2021')
+    monkeypatch.setattr(actuals_cache, 'CACHE_VERSION', actuals_cache.CACHE_VERSION + 1)
+    assert actuals_cache.cache_key(FD_FNAME, SD_FNAME, 53000000, '31/07/2021', '31/08/2021') != key
@@ -0,0 +1,33 @@
+import os
+
+import numpy as np
+import pytest
+
+from vaccination_data import current_vaccine_data
+from cohort_engine import cohort_projection, dose_stage
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+@pytest.fixture(scope='module')
+def actual_data():
+    return current_vaccine_data(os.path.join(HERE, 'first_dose_data_220321.csv'),
+                                os.path.join(HERE, 'second_dose_data_220321.csv'))
+
+
+def test_first_doses_reach_capped_target(actual_data):
+    cohorts = cohort_projection(actual_data)
+    result = cohorts.simulate()
+    assert result['cumulative'][0, 0, -1] == actual_data.target_val
+    assert not cohorts.target_hit_dates(result).isna().any()
+
+
+def test_capacity_is_never_exceeded(actual_data):
+    stages = [dose_stage('first_dose'), dose_stage('second_dose', interval_days=91),
+              dose_stage('booster', interval_days=182, uptake=0.8, max_share=0.5)]
+    cohorts = cohort_projection(actual_data, stages, end_date='31/12/2022')
+    capacity = cohorts.run_rate * np.random.default_rng(0).uniform(0.5, 1.5, (20, len(cohorts.dates)))
+    result = cohorts.simulate(capacity)
+    assert np.all(result['daily'].sum(axis=1) <= capacity * (1 + 1e-9))
+    assert np.all(result['daily'] >= 0)
+    assert np.all(result['daily'][:, 2].sum(axis=1) <= 0.5 * capacity.sum(axis=1) + 1)
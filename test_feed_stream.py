@@ -0,0 +1,72 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from feed_stream import KEY_COLUMNS, METRIC_COLUMNS, area_series_builder, stream_area_feeds
+
+
+def long_feed(n_days=30, seed=0):
+    """a long format feed of three areas, rows shuffled, with a blank day, a republished day and an area whose dates
+    don't parse (so reading it at all would fail)"""
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range('2021-01-10', periods=n_days, freq='D').strftime('%Y-%m-%d')
+    areas = []
+    for area_type, area_name, area_code in [('region', 'North', 'E12000001'), ('region', 'South', 'E12000008'),
+                                            ('nation', 'Wales', 'W92000004')]:
+        daily = rng.integers(1000, 5000, (n_days, 2))
+        areas.append(pd.DataFrame({'areaType': area_type, 'areaName': area_name, 'areaCode': area_code, 'date': dates,
+                                   METRIC_COLUMNS[0]: daily[:, 0].astype(np.float64),
+                                   METRIC_COLUMNS[1]: np.cumsum(daily[:, 0]),
+                                   METRIC_COLUMNS[2]: daily[:, 1].astype(np.float64),
+                                   METRIC_COLUMNS[3]: np.cumsum(daily[:, 1])}))
+    feed = pd.concat(areas, ignore_index=True)
+    feed.loc[3, METRIC_COLUMNS[0]] = np.nan
+    republished = feed.iloc[[5]].assign(**{METRIC_COLUMNS[1]: feed.loc[5, METRIC_COLUMNS[1]] + 1})
+    feed = pd.concat([feed.sample(frac=1, random_state=seed), republished], ignore_index=True)
+    feed.loc[feed['areaType'] == 'nation', 'date'] = 'not a date'
+    return feed[KEY_COLUMNS + METRIC_COLUMNS]
+
+
+def write_json_pages(feed, out_dir, page_size):
+    """feed as a chain of api style json pages, returns the first"""
+    records = json.loads(feed.to_json(orient='records'))
+    n_pages = -(-len(records) // page_size)
+    for i in range(n_pages):
+        page = {'data': records[i * page_size:(i + 1) * page_size],
+                'pagination': {'next': f'page_{i + 1}.json' if i + 1 < n_pages else None}}
+        with open(os.path.join(out_dir, f'page_{i}.json'), 'w') as f:
+            json.dump(page, f)
+    return os.path.join(out_dir, 'page_0.json')
+
+
+def test_csv_chunks_and_json_pages_give_the_same_areas(tmp_path):
+    feed = long_feed()
+    csv_fname = str(tmp_path / 'feed.csv')
+    feed.to_csv(csv_fname, index=False)
+    json_fname = write_json_pages(feed, str(tmp_path), page_size=17)
+
+    from_csv = stream_area_feeds(csv_fname, area_types=['region'], chunksize=13)
+    from_json = stream_area_feeds(json_fname, area_types=['region'])
+    assert sorted(from_csv) == sorted(from_json) == ['E12000001', 'E12000008']
+    for area_code in from_csv:
+        pd.testing.assert_frame_equal(from_csv[area_code], from_json[area_code])
+
+    north = from_csv['E12000001']
+    assert list(north.columns) == ['areaName', 'date'] + METRIC_COLUMNS
+    assert north['date'].is_monotonic_increasing and north['date'].is_unique
+    # the republished day replaces the first one
+    republished = feed.iloc[-1]
+    row = from_csv[republished['areaCode']].set_index('date').loc[pd.Timestamp(republished['date'])]
+    assert row[METRIC_COLUMNS[1]] == republished[METRIC_COLUMNS[1]]
+
+
+def test_areas_are_filtered_before_anything_is_kept():
+    feed = long_feed()
+    builder = area_series_builder(area_codes=['E12000008'])
+    for start in range(0, len(feed), 10):
+        builder.add_chunk(feed.iloc[start:start + 10].astype({'areaType': 'category', 'areaCode': 'category'}))
+    assert list(builder.pieces) == ['E12000008']
+    for piece in builder.pieces['E12000008']:
+        assert list(piece.columns) == ['date'] + METRIC_COLUMNS
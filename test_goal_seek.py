@@ -0,0 +1,38 @@
+import os
+
+import pytest
+
+from vaccination_data import current_vaccine_data
+from goal_seek import deadline_projection, evaluate_capacities, required_capacity
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+TOL = 1000
+
+
+@pytest.fixture(scope='module')
+def actual_data():
+    return current_vaccine_data(os.path.join(HERE, 'first_dose_data_220321.csv'),
+                                os.path.join(HERE, 'second_dose_data_220321.csv'))
+
+
+def evaluate(actual_data, deadline, capacities):
+    projection, inputs = deadline_projection(actual_data, deadline)
+    return evaluate_capacities(projection, inputs, capacities, actual_data.target_val)
+
+
+def test_required_capacity_is_the_lowest_that_hits(actual_data):
+    result = required_capacity(actual_data, tol=TOL)
+    assert not result['overflow_infeasible']
+    hit_pos, _, exhausted = evaluate(actual_data, None, [result['capacity'], result['capacity'] - TOL])
+    assert hit_pos[0] >= 0 and not exhausted[0]
+    assert hit_pos[1] < 0 and not exhausted[1]
+    assert result['target_hit_date'] <= result['deadline']
+
+
+def test_exhausted_lower_capacities_are_flagged(actual_data):
+    # with the later deadline the capacities just below the answer run second doses out of horizon
+    result = required_capacity(actual_data, deadline='31/08/2021', tol=TOL)
+    assert result['overflow_infeasible']
+    hit_pos, _, exhausted = evaluate(actual_data, '31/08/2021', [result['capacity'], result['capacity'] - TOL])
+    assert hit_pos[0] >= 0 and not exhausted[0]
+    assert hit_pos[1] < 0 and exhausted[1]
@@ -0,0 +1,84 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from vaccination_data import current_vaccine_data
+from projection_data import projected_data
+from incremental_update import incremental_projection, ACTUAL_COLUMNS
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PROJECTED_COLUMNS = ACTUAL_COLUMNS + ['due_by_today', 'sd_overflow']
+RUN_RATES = ['daily_avg_week', 'daily_avg_1month', 'daily_avg_3month']
+
+
+@pytest.fixture(scope='module')
+def feed():
+    """the shipped first and second dose csvs side by side, oldest first"""
+    fd_df = pd.read_csv(os.path.join(HERE, 'first_dose_data_220321.csv'))
+    sd_df = pd.read_csv(os.path.join(HERE, 'second_dose_data_220321.csv'))
+    feed = fd_df.merge(sd_df.drop(columns=['areaType', 'areaName', 'areaCode']), on='date')
+    feed['date'] = pd.to_datetime(feed['date'])
+    return feed.sort_values(by=['date']).reset_index(drop=True)
+
+
+def revised_rows(rows, rng):
+    """rows with their first and second doses moved by the same random amount, daily and cumulative"""
+    rows = rows.copy()
+    for dose in ['FirstDose', 'SecondDose']:
+        change = rng.integers(-5000, 5000, len(rows))
+        rows[f'newPeopleVaccinated{dose}ByPublishDate'] += change
+        rows[f'cumPeopleVaccinated{dose}ByPublishDate'] += change
+    return rows
+
+
+def assert_matches_rebuild(incremental, published):
+    """incremental state is bit identical to current_vaccine_data and a projection built from published"""
+    actual_data = current_vaccine_data.from_frames(published, published)
+    projection = projected_data(actual_data, randomise_daily_capacity="False", cache=None)
+    projection.collate_and_project_data()
+    held = incremental.actual_data
+
+    index, rebuilt = held.run_rate_index, actual_data.run_rate_index
+    assert np.array_equal(index.dates, rebuilt.dates)
+    assert np.array_equal(index.sums, rebuilt.sums)
+    assert np.array_equal(index.counts, rebuilt.counts)
+
+    assert held.today == actual_data.today
+    assert np.array_equal(held.unadjusted_first_row, actual_data.unadjusted_first_row, equal_nan=True)
+    for name in RUN_RATES:
+        assert np.array_equal(getattr(held, name), getattr(actual_data, name), equal_nan=True), name
+    assert np.array_equal(held.vac_df['date'].values, actual_data.vac_df['date'].values)
+    assert np.array_equal(held.vac_df[ACTUAL_COLUMNS].values.astype(np.float64),
+                          actual_data.vac_df[ACTUAL_COLUMNS].values.astype(np.float64), equal_nan=True)
+
+    assert incremental.projection.capacity == projection.capacity
+    held_df, rebuilt_df = incremental.projection.projected_df, projection.projected_df
+    assert np.array_equal(held_df['status'].values, rebuilt_df['status'].values)
+    assert np.array_equal(held_df[PROJECTED_COLUMNS].values.astype(np.float64),
+                          rebuilt_df[PROJECTED_COLUMNS].values.astype(np.float64), equal_nan=True)
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_appends_and_revisions_match_rebuild(feed, seed):
+    rng = np.random.default_rng(seed)
+    n_held = 40
+    published = feed.iloc[:n_held].copy()
+    incremental = incremental_projection(current_vaccine_data.from_frames(published, published))
+
+    while n_held < len(feed):
+        n_new = min(int(rng.integers(0, 5)), len(feed) - n_held)
+        # revisions land on any day held, now and then the first, whose prior allocation is redone
+        revised_pos = rng.integers(0, n_held, int(rng.integers(0, 4)))
+        revised_pos = np.unique(np.append(revised_pos, 0) if rng.random() < 0.2 else revised_pos)
+        revised = revised_rows(published.iloc[revised_pos], rng)
+        new_rows = pd.concat([revised, feed.iloc[n_held:n_held + n_new]])
+        if new_rows.empty:
+            continue
+
+        published.iloc[revised_pos] = revised.values
+        published = pd.concat([published, feed.iloc[n_held:n_held + n_new]], ignore_index=True)
+        n_held += n_new
+        incremental.update(new_rows.sample(frac=1, random_state=seed).reset_index(drop=True))
+        assert_matches_rebuild(incremental, published)
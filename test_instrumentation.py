@@ -0,0 +1,27 @@
+import tracemalloc
+
+import numpy as np
+import pytest
+
+from instrumentation import instrumentation, memory_sink
+
+
+@pytest.mark.parametrize('has_reset_peak', [True, False])
+def test_stage_peak_memory(monkeypatch, has_reset_peak):
+    if not has_reset_peak:
+        # python before 3.9
+        monkeypatch.delattr(tracemalloc, 'reset_peak', raising=False)
+    sink = memory_sink()
+    instrument = instrumentation(sink, trace_memory=True)
+    with instrument.stage('big'):
+        big = np.ones(1 << 20)
+    del big
+    with instrument.stage('small'):
+        small = np.ones(16)
+    del small
+    instrument.flush()
+
+    stages = sink.records[0]['stages']
+    assert stages['big']['peak_memory_bytes'] >= 8 << 20
+    assert stages['small']['peak_memory_bytes'] < 1 << 20
+    assert not tracemalloc.is_tracing()
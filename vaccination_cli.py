@@ -0,0 +1,186 @@
+"""Headless batch mode: run a grid of projection scenarios and write tables, figures and plot specs to disk.
+
+    python vaccination_cli.py first_dose_data_220321.csv second_dose_data_220321.csv reports/ \\
+        --windows weekly_avg monthly_avg --randomise True False --std-devs 0.1 0.2 \\
+        --target-dates 31/07/2021 31/08/2021 --workers 4
+
+Each scenario gets its own directory with the projection table (csv), a json plotly spec per figure and a static
+render of each figure (png/svg through kaleido if installed, html otherwise). A manifest.json at the top level lists
+every scenario, its parameters, target hit message and files, so the dashboard can serve the precomputed artefacts.
+A scenario that fails (e.g. second dose overflow running out of horizon) is listed with its error instead of files.
+"""
+import argparse
+import importlib.util
+import itertools
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from functools import partial
+
+from actuals_cache import load_actual_data
+from projection_data import projected_data
+from instrumentation import instrumentation, memory_sink, jsonl_sink
+
+PLOTS = ['daily_doses_projection_plot', 'cumulative_doses_plot', 'second_doses_by_month_perc_plot',
+         'second_dose_backlog_daily_plot', 'second_dose_backlog_cumu_plot']
+
+
+def scenario_grid(windows, randomise, std_devs, target_dates):
+    """every combination of the options. std dev only matters when randomising, so deterministic scenarios are not
+    repeated per std dev"""
+    scenarios = []
+    for window, rand, std_dev, target_date in itertools.product(windows, randomise, std_devs, target_dates):
+        scenario = {'run_rate_window': window,
+                    'randomise_daily_capacity': rand,
+                    'std_dev': std_dev if rand == "True" else None,
+                    'target_date': target_date}
+        if scenario not in scenarios:
+            scenarios.append(scenario)
+    return scenarios
+
+
+def scenario_name(scenario):
+    target = datetime.strptime(scenario['target_date'], '%d/%m/%Y').strftime('%Y-%m-%d')
+    if scenario['randomise_daily_capacity'] == "True":
+        return f"{scenario['run_rate_window']}-random-{scenario['std_dev']}-{target}"
+    return f"{scenario['run_rate_window']}-fixed-{target}"
+
+
+def write_figure(fig, path_stem, image_format):
+    """json spec always, plus a static render. returns the files written"""
+    files = [f'{path_stem}.json']
+    with open(files[0], 'w') as f:
+        f.write(fig.to_json())
+    if image_format != 'html' and importlib.util.find_spec('kaleido') is not None:
+        fig.write_image(f'{path_stem}.{image_format}')
+        return files + [f'{path_stem}.{image_format}']
+    fig.write_html(f'{path_stem}.html', include_plotlyjs='cdn')
+    return files + [f'{path_stem}.html']
+
+
+def run_scenario(fd_fname, sd_fname, scenario, out_dir, image_format='png', seed=None, cache_dir=None, metrics=False):
+    """project one scenario and write its artefacts. returns the manifest entry, with the scenario's
+    instrumentation record under 'metrics' if asked for"""
+    instrument = instrumentation(memory_sink()) if metrics else None
+    actual_data = load_actual_data(fd_fname, sd_fname, orig_target_date=scenario['target_date'],
+                                   cache_dir=cache_dir or os.path.join(out_dir, '.cache'))
+    projection = projected_data(actual_data, run_rate_window=scenario['run_rate_window'],
+                                randomise_daily_capacity=scenario['randomise_daily_capacity'],
+                                std_dev=scenario['std_dev'] or 0.1, seed=seed, cache=None, instrument=instrument)
+    projection.collate_and_project_data()
+    projection.est_target_hit_date()
+
+    name = scenario_name(scenario)
+    scenario_dir = os.path.join(out_dir, name)
+    os.makedirs(scenario_dir, exist_ok=True)
+    table_fname = os.path.join(scenario_dir, 'projection.csv')
+    projection.projected_df.to_csv(table_fname, index=False)
+
+    files = [table_fname]
+    with projection.stage('write_figures'):
+        for plot in PLOTS:
+            files += write_figure(getattr(projection, plot)(), os.path.join(scenario_dir, plot), image_format)
+
+    entry = {'name': name,
+             'params': scenario,
+             'seed': seed,
+             'capacity': float(projection.capacity),
+             'date_hit': projection.date_hit,
+             'files': [os.path.relpath(f, out_dir) for f in files]}
+    if instrument is not None:
+        entry['metrics'] = projection.flush_metrics(scenario=name)
+    return entry
+
+
+def write_waffle(fd_fname, sd_fname, target_date, out_dir, cache_dir):
+    """the waffle chart only depends on the actuals, so it's rendered once per target"""
+    import matplotlib
+    matplotlib.use('Agg')
+
+    actual_data = load_actual_data(fd_fname, sd_fname, orig_target_date=target_date, cache_dir=cache_dir)
+    fig = actual_data.plot_waffle_chart()
+    fname = os.path.join(out_dir, f"waffle-{datetime.strptime(target_date, '%d/%m/%Y').strftime('%Y-%m-%d')}.png")
+    fig.savefig(fname)
+    return os.path.relpath(fname, out_dir)
+
+
+def collect_entries(results, scenarios, seed):
+    """manifest entries from one callable per scenario (run_scenario bound to its args, or a future's result). a
+    scenario that raises is recorded with its error, so one failure doesn't lose the rest of the grid"""
+    entries = []
+    for result, scenario in zip(results, scenarios):
+        try:
+            entries.append(result())
+        except Exception as e:
+            entries.append({'name': scenario_name(scenario),
+                            'params': scenario,
+                            'seed': seed,
+                            'error': f'{type(e).__name__}: {e}',
+                            'files': []})
+    return entries
+
+
+def run_grid(fd_fname, sd_fname, out_dir, scenarios, n_workers=None, image_format='png', seed=None, metrics_fname=None):
+    """run every scenario across a process pool and write manifest.json. metrics_fname appends each scenario's stage
+    timings and counters to a json lines file. returns the manifest"""
+    os.makedirs(out_dir, exist_ok=True)
+    cache_dir = os.path.join(out_dir, '.cache')
+
+    # prepare the actuals once per target up front so the workers all start from the disk cache
+    for target_date in sorted({scenario['target_date'] for scenario in scenarios}):
+        load_actual_data(fd_fname, sd_fname, orig_target_date=target_date, cache_dir=cache_dir)
+
+    args = [(fd_fname, sd_fname, scenario, out_dir, image_format, seed, cache_dir, metrics_fname is not None)
+            for scenario in scenarios]
+    if n_workers == 1:
+        entries = collect_entries([partial(run_scenario, *arg) for arg in args], scenarios, seed)
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            futures = [executor.submit(run_scenario, *arg) for arg in args]
+            entries = collect_entries([future.result for future in futures], scenarios, seed)
+    if metrics_fname is not None:
+        sink = jsonl_sink(metrics_fname)
+        for entry in entries:
+            if 'metrics' in entry:
+                sink.write(entry.pop('metrics'))
+
+    waffles = {target_date: write_waffle(fd_fname, sd_fname, target_date, out_dir, cache_dir)
+               for target_date in sorted({scenario['target_date'] for scenario in scenarios})}
+
+    manifest = {'generated': datetime.now().isoformat(timespec='seconds'),
+                'inputs': {'first_dose': fd_fname, 'second_dose': sd_fname},
+                'waffle_charts': waffles,
+                'scenarios': entries}
+    with open(os.path.join(out_dir, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('fd_fname', help='first dose csv')
+    parser.add_argument('sd_fname', help='second dose csv')
+    parser.add_argument('out_dir', help='directory to write the artefacts to')
+    parser.add_argument('--windows', nargs='+', default=['weekly_avg'], choices=['weekly_avg', 'monthly_avg', '3_month_avg'])
+    parser.add_argument('--randomise', nargs='+', default=['False'], choices=['True', 'False'])
+    parser.add_argument('--std-devs', nargs='+', type=float, default=[0.1])
+    parser.add_argument('--target-dates', nargs='+', default=['31/07/2021'], help='dd/mm/yyyy')
+    parser.add_argument('--seed', type=int, default=None, help='seed for randomised scenarios')
+    parser.add_argument('--workers', type=int, default=None, help='process pool size, 1 to run in process')
+    parser.add_argument('--image-format', default='png', choices=['png', 'svg', 'html'],
+                        help='static figure format. png/svg need kaleido, html is used when it is missing')
+    parser.add_argument('--metrics', default=None, help='json lines file to append per scenario stage timings to')
+    args = parser.parse_args(argv)
+
+    scenarios = scenario_grid(args.windows, args.randomise, args.std_devs, args.target_dates)
+    manifest = run_grid(args.fd_fname, args.sd_fname, args.out_dir, scenarios, args.workers, args.image_format, args.seed,
+                        args.metrics)
+    failed = [entry['name'] for entry in manifest['scenarios'] if 'error' in entry]
+    print(f"{len(manifest['scenarios']) - len(failed)} scenarios written to {args.out_dir}")
+    if failed:
+        print(f"{len(failed)} failed, see manifest.json: {', '.join(failed)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,16 +1,121 @@
 import copy
+import hashlib
 import numpy as np
 import pandas as pd
 from datetime import date, datetime, timedelta
-from dateutil.relativedelta import relativedelta
-import matplotlib.pyplot as plt
-from pywaffle import Waffle
-import plotly.graph_objects as go
+
+FEED_COLUMNS = {'newPeopleVaccinatedFirstDoseByPublishDate': 'daily_first_dose',
+                'cumPeopleVaccinatedFirstDoseByPublishDate': 'cumu_first_dose',
+                'newPeopleVaccinatedSecondDoseByPublishDate': 'daily_second_dose',
+                'cumPeopleVaccinatedSecondDoseByPublishDate': 'cumu_second_dose'}
+# gap between first and second doses, second doses fall due on date + DOSE_INTERVAL
+DOSE_INTERVAL = pd.DateOffset(months=3)
+STAT_COLUMNS = ['daily_all_vac', 'daily_first_dose', 'daily_second_dose']
+RUN_RATE_WINDOWS = {'daily_avg_3month': pd.DateOffset(months=3),
+                    'daily_avg_1month': pd.DateOffset(months=1),
+                    'daily_avg_week': pd.DateOffset(days=7)}
+
+
+class run_rate_index():
+    """prefix sums (and counts, blanks skipped like pandas mean) of the daily stats over vac_df. the average of any
+    window is two lookups and a subtraction. on a one row per day index the lookups are day offsets, so any window
+    ending at any anchor date is O(1), and arrays of windows are answered in one go. new days are added with append
+    and revised ones with revise, without rebuilding from the whole history"""
+
+    def __init__(self, vac_df):
+        dates = vac_df['date'].values.astype('datetime64[ns]')
+        values = vac_df[STAT_COLUMNS].values.astype(np.float64)
+        present = ~np.isnan(values)
+        self.date_buffer = dates
+        self.sum_buffer = np.vstack([np.zeros(len(STAT_COLUMNS)), np.cumsum(np.where(present, values, 0), axis=0)])
+        self.count_buffer = np.vstack([np.zeros(len(STAT_COLUMNS), dtype=np.int64), np.cumsum(present, axis=0)])
+        self.set_length(len(dates))
+        self.daily = len(dates) > 0 and bool(np.all(np.diff(dates) == np.timedelta64(1, 'D'))) and \
+            dates[0] == dates[0].astype('datetime64[D]')
+
+    def set_length(self, n_rows):
+        """dates, sums and counts are views on the first n_rows of the buffers, which append grows ahead of need"""
+        self.dates = self.date_buffer[:n_rows]
+        self.sums = self.sum_buffer[:n_rows + 1]
+        self.counts = self.count_buffer[:n_rows + 1]
+
+    def append(self, dates, values):
+        """add (days, 3) stats for dates after the last row. the buffers double when full, so appending is O(days
+        added) amortised"""
+        dates = np.asarray(dates, dtype='datetime64[ns]')
+        values = np.asarray(values, dtype=np.float64).reshape(len(dates), len(STAT_COLUMNS))
+        n_rows, n_new = len(self.dates), len(dates)
+        if n_rows + n_new > len(self.date_buffer):
+            size = max(2 * len(self.date_buffer), n_rows + n_new)
+            self.date_buffer = np.concatenate([self.dates, np.empty(size - n_rows, dtype=self.dates.dtype)])
+            self.sum_buffer = np.vstack([self.sums, np.empty((size - n_rows, len(STAT_COLUMNS)))])
+            self.count_buffer = np.vstack([self.counts, np.empty((size - n_rows, len(STAT_COLUMNS)), dtype=np.int64)])
+
+        present = ~np.isnan(values)
+        self.date_buffer[n_rows:n_rows + n_new] = dates
+        self.sum_buffer[n_rows + 1:n_rows + n_new + 1] = self.sums[-1] + np.cumsum(np.where(present, values, 0), axis=0)
+        self.count_buffer[n_rows + 1:n_rows + n_new + 1] = self.counts[-1] + np.cumsum(present, axis=0)
+        if n_rows:
+            self.daily = self.daily and bool(np.all(np.diff(np.append(self.dates[-1:], dates)) == np.timedelta64(1, 'D')))
+        self.set_length(n_rows + n_new)
+
+    def revise(self, pos, values):
+        """replace the stats of the row at pos. every prefix sum after it shifts by the change, so this is O(rows after
+        pos), short for the recent days revisions usually touch"""
+        values = np.asarray(values, dtype=np.float64)
+        present = ~np.isnan(values)
+        self.sums[pos + 1:] += np.where(present, values, 0) - (self.sums[pos + 1] - self.sums[pos])
+        self.counts[pos + 1:] += present - (self.counts[pos + 1] - self.counts[pos])
+
+    def rows_through(self, dates):
+        """number of rows dated on or before each date"""
+        dates = np.asarray(dates, dtype='datetime64[ns]')
+        if self.daily:
+            offsets = (dates - self.dates[0]) // np.timedelta64(1, 'D') + 1
+            return np.clip(offsets, 0, len(self.dates))
+        return np.searchsorted(self.dates, dates, side='right')
+
+    def rows_before(self, dates):
+        """number of rows dated before each date"""
+        dates = np.asarray(dates, dtype='datetime64[ns]')
+        if self.daily:
+            offsets = -((self.dates[0] - dates) // np.timedelta64(1, 'D'))
+            return np.clip(offsets, 0, len(self.dates))
+        return np.searchsorted(self.dates, dates, side='left')
+
+    def means(self, start, end=None):
+        """(all vacs, fd, sd) daily average over rows dated after start and before end (no end: all later rows).
+        start/end can be arrays, giving a (windows, 3) array"""
+        lo = self.rows_through(start)
+        hi = len(self.dates) if end is None else self.rows_before(end)
+        hi = np.maximum(hi, lo)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return (self.sums[hi] - self.sums[lo]) / (self.counts[hi] - self.counts[lo])
+
+    def run_rates(self, anchors):
+        """the three run rate windows ending at each anchor date (data dated before the anchor), as a dict of
+        (anchors, 3) arrays keyed like the current_vaccine_data attributes"""
+        anchors = pd.DatetimeIndex(np.atleast_1d(np.asarray(anchors, dtype='datetime64[ns]')))
+        return {name: self.means((anchors - offset).values, anchors.values) for name, offset in RUN_RATE_WINDOWS.items()}
+
 
 class current_vaccine_data():
 
     def __init__(self, fd_fname, sd_fname, target_val = 53000000, orig_target_date = '31/07/2021', rev_target_date = '31/08/2021'):
         self.read_in_data(fd_fname, sd_fname)
+        self.prepare_data(target_val, orig_target_date, rev_target_date)
+
+    @classmethod
+    def from_frames(cls, vac1_df, vac2_df, target_val = 53000000, orig_target_date = '31/07/2021', rev_target_date = '31/08/2021'):
+        """build from first and second dose dfs already in memory (govt csv columns, dates parsed). one df holding both
+        sets of metric columns, e.g. one area of a long format feed, can be passed as both"""
+        obj = cls.__new__(cls)
+        obj.combine_feeds(vac1_df, vac2_df)
+        obj.prepare_data(target_val, orig_target_date, rev_target_date)
+        return obj
+
+    def prepare_data(self, target_val = 53000000, orig_target_date = '31/07/2021', rev_target_date = '31/08/2021'):
+        """targets, waffle data and run rates off the combined vac_df"""
         self.set_targets(target_val, orig_target_date, rev_target_date)
         self.create_waffle_data()
         self.run_rate_stats()
@@ -18,27 +123,34 @@ class current_vaccine_data():
 
 
     def read_in_data(self, fd_fname, sd_fname):
-        """Take the govt csv for first and second doses and returns a combined df of both"""
-        vac1_df = pd.read_csv(fd_fname)
-        vac2_df = pd.read_csv(sd_fname)
-
-        self.vac_df = vac1_df
-        self.vac_df['newPeopleVaccinatedSecondDoseByPublishDate'] = vac2_df['newPeopleVaccinatedSecondDoseByPublishDate']
-        self.vac_df['cumPeopleVaccinatedSecondDoseByPublishDate'] = vac2_df['cumPeopleVaccinatedSecondDoseByPublishDate']
-
-        self.vac_df = self.vac_df.rename(columns={'newPeopleVaccinatedFirstDoseByPublishDate': 'daily_first_dose',
-                                        'cumPeopleVaccinatedFirstDoseByPublishDate': 'cumu_first_dose',
-                                        'newPeopleVaccinatedSecondDoseByPublishDate': 'daily_second_dose',
-                                        'cumPeopleVaccinatedSecondDoseByPublishDate': 'cumu_second_dose'})
-
-        self.vac_df = self.vac_df.drop(columns=['areaType', 'areaCode'])
+        """Take the govt csv for first and second doses and returns a combined df of both, joined on date"""
+        vac1_df = pd.read_csv(fd_fname, usecols=['areaName', 'date', 'newPeopleVaccinatedFirstDoseByPublishDate',
+                                                 'cumPeopleVaccinatedFirstDoseByPublishDate'],
+                              dtype={'areaName': 'category',
+                                     'newPeopleVaccinatedFirstDoseByPublishDate': 'float64',
+                                     'cumPeopleVaccinatedFirstDoseByPublishDate': 'int64'})
+        vac2_df = pd.read_csv(sd_fname, usecols=['date', 'newPeopleVaccinatedSecondDoseByPublishDate',
+                                                 'cumPeopleVaccinatedSecondDoseByPublishDate'],
+                              dtype={'newPeopleVaccinatedSecondDoseByPublishDate': 'float64',
+                                     'cumPeopleVaccinatedSecondDoseByPublishDate': 'int64'})
+
+        vac1_df['date'] = pd.to_datetime(vac1_df['date'], dayfirst=True)
+        vac2_df['date'] = pd.to_datetime(vac2_df['date'], dayfirst=True)
+        self.combine_feeds(vac1_df, vac2_df)
+
+    def combine_feeds(self, vac1_df, vac2_df):
+        """join first and second dose dfs on date, rename to the working column names and add derived columns"""
+        vac1_df = vac1_df[['areaName', 'date', 'newPeopleVaccinatedFirstDoseByPublishDate',
+                           'cumPeopleVaccinatedFirstDoseByPublishDate']]
+        vac2_df = vac2_df[['date', 'newPeopleVaccinatedSecondDoseByPublishDate',
+                           'cumPeopleVaccinatedSecondDoseByPublishDate']]
+        self.vac_df = vac1_df.merge(vac2_df, on='date', how='left', validate='one_to_one')
+
+        self.vac_df = self.vac_df.rename(columns=FEED_COLUMNS)
 
         self.vac_df['vac_backlog'] = self.vac_df['cumu_first_dose'] - self.vac_df['cumu_second_dose']
         self.vac_df['daily_all_vac'] = self.vac_df['daily_first_dose'] + self.vac_df['daily_second_dose']
-
-        self.vac_df['date'] = pd.to_datetime(self.vac_df['date'], dayfirst=True)
-        for i in self.vac_df.index:
-            self.vac_df.loc[i, 'second_vac_cutoff'] = self.vac_df.loc[i, 'date'] + relativedelta(months=3)
+        self.vac_df['second_vac_cutoff'] = self.vac_df['date'] + DOSE_INTERVAL
 
         self.vac_df = self.vac_df.sort_values(by=['date']).reset_index(drop=True)
 
@@ -46,17 +158,25 @@ class current_vaccine_data():
         """Set target values and dates to base projections on"""
         orig_target_date = datetime.strptime(orig_target_date, '%d/%m/%Y')
         rev_target_date = datetime.strptime(rev_target_date, '%d/%m/%Y')
-        today = datetime.strptime('21/03/2021', '%d/%m/%Y')
-
-        diff_1 = orig_target_date - today
-        diff_2 = rev_target_date - today
+        # projections start the day after the latest actuals
+        today = (self.vac_df['date'].max() + timedelta(days=1)).to_pydatetime()
 
         self.target_val = target_val
         self.orig_target_date = orig_target_date
         self.rev_target_date = rev_target_date
+        self.set_today(today)
+
+    def data_version(self):
+        """hash of the prepared actuals, targets and today. identifies the data a projection was built from"""
+        digest = hashlib.sha256(pd.util.hash_pandas_object(self.vac_df, index=False).values.tobytes())
+        digest.update(repr((self.target_val, self.orig_target_date, self.rev_target_date, self.today)).encode())
+        return digest.hexdigest()
+
+    def set_today(self, today):
+        """move the date projections start from, keeping the target dates"""
         self.today = today
-        self.diff_1 = diff_1
-        self.diff_2 = diff_2
+        self.diff_1 = self.orig_target_date - today
+        self.diff_2 = self.rev_target_date - today
 
 
 
@@ -77,7 +197,10 @@ class current_vaccine_data():
 
 
     def plot_waffle_chart(self):
-        """Plot a waffle chart"""
+        """Plot a waffle chart. matplotlib and pywaffle are only imported here so headless use never loads them"""
+        import matplotlib.pyplot as plt
+        from pywaffle import Waffle
+
         fig = plt.figure(
             FigureClass=Waffle,
             rows=10,
@@ -101,20 +224,10 @@ class current_vaccine_data():
 
 
     def run_rate_stats(self):
-        """get daily vac rate (last 3 months, last month, last week)"""
-
-        prev_3month = self.today - relativedelta(months=3)
-        daily_avg_3month = self.get_stats(self.vac_df, prev_3month)
-
-        prev_month = self.today - relativedelta(months=1)
-        daily_avg_1month = self.get_stats(self.vac_df, prev_month)
-
-        prev_week = self.today - relativedelta(days=7)
-        daily_avg_week = self.get_stats(self.vac_df, prev_week)
-
-        self.daily_avg_3month = daily_avg_3month
-        self.daily_avg_1month = daily_avg_1month
-        self.daily_avg_week = daily_avg_week
+        """get daily vac rate (last 3 months, last month, last week) up to today, from the prefix sum index"""
+        self.run_rate_index = run_rate_index(self.vac_df)
+        for name, rates in self.run_rate_index.run_rates(self.today).items():
+            setattr(self, name, tuple(rates[0]))
 
 
     def raw_nums_remaining(self, avg_rr_all, avg_rr_fd):
@@ -125,6 +238,7 @@ class current_vaccine_data():
 
 
     def adjust_prior_data(self):
+        self.unadjusted_first_row = (self.vac_df.loc[0, 'daily_first_dose'], self.vac_df.loc[0, 'daily_second_dose'])
         prior_fd = self.vac_df.loc[0, 'cumu_first_dose']
         prior_sd = self.vac_df.loc[self.vac_df.index.max(), 'cumu_second_dose']
         one_off_allocate = prior_fd - prior_sd
@@ -134,7 +248,8 @@ class current_vaccine_data():
 
 ##################################################################################################
 
-fd_fname = 'first_dose_data_220321.csv'
-sd_fname = 'second_dose_data_220321.csv'
-test_run = current_vaccine_data(fd_fname, sd_fname)
-#test_run.vac_df.to_csv('test_output.csv')
\ No newline at end of file
+if __name__ == '__main__':
+    fd_fname = 'first_dose_data_220321.csv'
+    sd_fname = 'second_dose_data_220321.csv'
+    test_run = current_vaccine_data(fd_fname, sd_fname)
+    #test_run.vac_df.to_csv('test_output.csv')
@@ -1,8 +1,11 @@
 import streamlit as st
-from vaccination_data import current_vaccine_data
+from actuals_cache import load_actual_data
 from projection_data import projected_data
+from capacity_models import capacity_model, exponential_growth, weekday_profile
+from figure_layer import build_figures
+from instrumentation import instrumentation
+from goal_seek import required_capacity
 
-# @TODO: Give option for capacity growth
 # @TODO: Fix monthly capacity to reflect actual capacity for historic dates
 # @TODO: Fix waffle chart % and size
 
@@ -11,7 +14,7 @@ sd_fname = 'second_dose_data_220321.csv'
 
 @st.cache
 def get_actual_data(fd_fname, sd_fname):
-    return current_vaccine_data(fd_fname, sd_fname)
+    return load_actual_data(fd_fname, sd_fname)
 
 
 actual_vaccine_data = get_actual_data(fd_fname, sd_fname)
@@ -25,19 +28,34 @@ st.sidebar.write('**Random Factor To Daily Capacity**')
 set_random = st.sidebar.radio('', ["Randomise", "Don't Randomise"], index=0)
 st.sidebar.write('**Control Daily Capacity Randomness**')
 std_dev = st.sidebar.slider('', min_value=0.05, max_value=0.25)
-
+st.sidebar.write('**Weekly Capacity Growth %**')
+growth_pct = st.sidebar.slider('', min_value=0.0, max_value=10.0, value=0.0, step=0.5)
+weekday_pattern = st.sidebar.checkbox('Apply weekday pattern to capacity', value=False)
+debug_panel = st.sidebar.checkbox('Show debug panel', value=False)
+instrument = instrumentation(trace_memory=True) if debug_panel else None
+
+components = []
+if growth_pct:
+    components.append(exponential_growth(growth_pct / 100))
+if weekday_pattern:
+    components.append(weekday_profile(actual_vaccine_data.vac_df))
+model = capacity_model(*components) if components else None
 
 if set_random == 'Randomise':
-    test = projected_data(actual_vaccine_data, randomise_daily_capacity='True', std_dev=std_dev, run_rate_window=run_rate_radio)
+    test = projected_data(actual_vaccine_data, randomise_daily_capacity='True', std_dev=std_dev, run_rate_window=run_rate_radio,
+                          capacity_model=model, instrument=instrument)
 else:
-    test = projected_data(actual_vaccine_data, randomise_daily_capacity='False', run_rate_window=run_rate_radio)
+    test = projected_data(actual_vaccine_data, randomise_daily_capacity='False', run_rate_window=run_rate_radio,
+                          capacity_model=model, instrument=instrument)
 
 test.collate_and_project_data()
-second_dose_backlog_fig = test.second_dose_backlog_cumu_plot()
-daily_doses_fig = test.daily_doses_projection_plot()
-waffle = actual_vaccine_data.plot_waffle_chart()
-cumu_doses_fig = test.cumulative_doses_plot()
-second_dose_as_perc_cap_plot = test.second_doses_by_month_perc_plot()
+with test.stage('build_figures'):
+    figures = build_figures(test)
+second_dose_backlog_fig = figures['second_dose_backlog_cumu_plot']
+daily_doses_fig = figures['daily_doses_projection_plot']
+waffle = figures['waffle_chart']
+cumu_doses_fig = figures['cumulative_doses_plot']
+second_dose_as_perc_cap_plot = figures['second_doses_by_month_perc_plot']
 test.est_target_hit_date()
 
 st.write("""
@@ -50,6 +68,20 @@ Use the widgets on the left to change the inputs.""")
 
 st.write(test.date_hit)
 
+with st.beta_expander("Capacity Needed To Hit The Target"):
+    for deadline in [actual_vaccine_data.orig_target_date, actual_vaccine_data.rev_target_date]:
+        needed = required_capacity(actual_vaccine_data, deadline=deadline.strftime('%d/%m/%Y'),
+                                   run_rate_window=run_rate_radio, capacity_model=model)
+        if needed['capacity'] is None:
+            st.write(f"Out of reach by {deadline.date()} at any realistic daily capacity")
+        else:
+            st.write(f"By {deadline.date()}: {int(needed['capacity']):,} doses a day "
+                     f"({needed['capacity_multiplier']:.0%} of the current run rate), peaking at "
+                     f"{int(needed['peak_backlog']):,} second doses outstanding")
+            if needed['overflow_infeasible']:
+                st.write("Below that the second doses falling due can't all be scheduled before the deadline, so the "
+                         "projection isn't valid there")
+
 # slider for % change in capacity
 
 st.subheader("Daily Doses Projection")
@@ -102,6 +134,10 @@ with st.beta_expander("% Progress Explanation"):
     """)
 
 
+if instrument is not None:
+    with st.beta_expander("Debug Panel", expanded=True):
+        st.json(test.flush_metrics())
+
 st.subheader("General Explainer")
 
 st.write("""The idea behind this dashboard is to help track and visualise the vaccination rate, particularly around how the focus on the first dose has